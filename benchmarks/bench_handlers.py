@@ -0,0 +1,148 @@
+"""
+Benchmarks the bot's handlers against a local Postgres with stubbed Telegram and OpenLibrary.
+
+The DB_* environment variables select the database. Every table in it is dropped and recreated, so point it at a
+scratch database:
+
+    DB_DB=book_club_bench python3 benchmarks/bench_handlers.py --clubs 200 --suggestions 50 --latency 0.05
+"""
+import argparse
+import os
+import sys
+from datetime import timedelta
+from statistics import mean
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('INLINE_DEBOUNCE_SECONDS', '0')
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import bot
+from clubs import clubs
+from db.models import engine, Base, session_scope, book_cache, Club, Admin, Meeting, Suggestion, ScheduledOffsetTask, task_to_meeting_table
+from db.query_stats import track_queries
+from utils import utcnow
+from members import member_names
+from outbox import outbox
+from scheduler import offset_tasks
+from search import book_search
+from fakes import Recorder, FakeBot, FakeOpenLibrary, FakeHttp, fake_update, fake_context
+
+ADMIN_ID = 1000
+
+
+def chat_id(i: int) -> int:
+    return -1000000 - i
+
+
+def seed(args) -> None:
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    now = utcnow()
+    with session_scope() as session:
+        for i in range(args.clubs):
+            club = Club(name=f'Club {i}', chat_id=str(chat_id(i)))
+            club.admins.append(Admin(user_id=str(ADMIN_ID)))
+            club.meetings.extend(Meeting(date_time=now + timedelta(days=d + 1), book_pages='1-100') for d in range(args.meetings))
+            club.suggestions.extend(
+                Suggestion(book_olid=f'OL{(i + s) % args.books}M', suggested_by=str(ADMIN_ID + s % 10)) for s in range(args.suggestions))
+            club.scheduled_offset_tasks.extend(
+                ScheduledOffsetTask(action='nag', when=f'{t + 1} hours', offset_seconds=(t + 1) * 3600) for t in range(args.tasks))
+            session.add(club)
+        session.commit()
+    clubs.load()
+
+
+def make_tasks_due() -> None:
+    """Points every offset task at its club's first meeting and makes it due"""
+    with session_scope() as session:
+        session.execute(task_to_meeting_table.delete())
+        first_meetings = dict(session.query(Meeting.club_id, Meeting.id).distinct(Meeting.club_id).order_by(Meeting.club_id, Meeting.date_time))
+        for task in session.query(ScheduledOffsetTask):
+            task.next_meeting_id = first_meetings.get(task.club_id)
+            task.next_run_at = utcnow() - timedelta(seconds=1)
+        session.commit()
+
+
+def clear_caches() -> None:
+    book_cache.memory.clear()
+    member_names.names.clear()
+    book_search.pages.clear()
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run(name, iterations, make_call, recorder, cold, setup=None):
+    latencies, statements, outbound = [], [], []
+    for i in range(iterations):
+        if setup:
+            setup()
+        if cold:
+            clear_caches()
+        call = make_call(i)
+        calls_before = recorder.total()
+        with track_queries() as stats:
+            started = perf_counter()
+            call()
+            latencies.append(perf_counter() - started)
+        outbox.drain()
+        statements.append(stats.statements)
+        outbound.append(recorder.total() - calls_before)
+    print(f'{name:28} p50 {percentile(latencies, 50) * 1000:8.1f}ms  p90 {percentile(latencies, 90) * 1000:8.1f}ms  '
+          f'p99 {percentile(latencies, 99) * 1000:8.1f}ms  sql {mean(statements):7.1f}  outbound {mean(outbound):6.1f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clubs', type=int, default=50)
+    parser.add_argument('--meetings', type=int, default=5, help='meetings per club')
+    parser.add_argument('--suggestions', type=int, default=20, help='suggestions per club')
+    parser.add_argument('--tasks', type=int, default=2, help='offset tasks per club')
+    parser.add_argument('--books', type=int, default=200, help='distinct books suggested across all clubs')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake Telegram/OpenLibrary call')
+    parser.add_argument('--cold', action='store_true', help='clear in-process caches before every iteration')
+    args = parser.parse_args()
+
+    recorder = Recorder(args.latency)
+    fake_bot = FakeBot(recorder)
+    book_cache.openlibrary = FakeOpenLibrary(recorder)
+    book_search.http = FakeHttp(recorder)
+    book_cache.http = FakeHttp(recorder)
+    # Rate limiting is Telegram's concern, the benchmark only measures the bot
+    outbox.configure(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    outbox.start(fake_bot)
+
+    seed(args)
+    print(f'{args.clubs} clubs, {args.meetings} meetings, {args.suggestions} suggestions and {args.tasks} tasks per club, '
+          f'{args.latency * 1000:g}ms fake latency{", cold caches" if args.cold else ""}\n')
+
+    def club_chat(i):
+        return chat_id(i % args.clubs)
+
+    run('suggestions', args.iterations, lambda i: lambda: bot.suggestions(
+        fake_update(fake_bot, club_chat(i)), fake_context(fake_bot)), recorder, args.cold)
+    pages = max(1, -(-args.suggestions // 4))
+    run('suggestions_page_callback', args.iterations, lambda i: lambda: bot.suggestions_page_callback(
+        fake_update(fake_bot, club_chat(i), callback_data=f'psug#{i % pages + 1}'), fake_context(fake_bot)), recorder, args.cold)
+    run('next_meeting', args.iterations, lambda i: lambda: bot.next_meeting(
+        fake_update(fake_bot, club_chat(i)), fake_context(fake_bot)), recorder, args.cold)
+    run('open_poll', args.iterations, lambda i: lambda: bot.open_poll(
+        fake_update(fake_bot, club_chat(i), user_id=ADMIN_ID), fake_context(fake_bot)), recorder, args.cold)
+    run('inlinequery', args.iterations, lambda i: lambda: bot.inlinequery(
+        fake_update(fake_bot, inline_query=f'book {i % 10}'), fake_context(fake_bot)), recorder, args.cold)
+    run('offset tasks (all due)', max(1, args.iterations // 10), lambda i: lambda: offset_tasks.run_due(
+        fake_context(fake_bot)), recorder, args.cold, setup=make_tasks_due)
+
+    print('\nOutbound calls by method:')
+    for method, calls in recorder.calls.most_common():
+        print(f'    {method:28} {calls}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""In-process stand-ins for the Telegram Bot API and OpenLibrary that count calls and add a fixed latency"""
+from collections import Counter
+from itertools import count
+from threading import Lock
+from time import sleep
+from types import SimpleNamespace
+
+
+class Recorder:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = Lock()
+
+    def record(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            sleep(self.latency)
+
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+_message_ids = count(1)
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, **kwargs):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = next(_message_ids)
+        self.photo = [SimpleNamespace(file_id=f'photo-{self.message_id}')]
+        self.poll = SimpleNamespace(id=f'poll-{self.message_id}', options=[
+            SimpleNamespace(text=text, voter_count=0) for text in kwargs.get('options', [])])
+
+    def pin(self, **kwargs):
+        return self.bot.pin_chat_message(self.chat_id, self.message_id, **kwargs)
+
+    def delete(self, **kwargs):
+        return self.bot.delete_message(self.chat_id, self.message_id, **kwargs)
+
+
+class FakeBot:
+    """Accepts any Bot API method, records it and returns a FakeMessage"""
+
+    def __init__(self, recorder: Recorder):
+        self.recorder = recorder
+
+    def get_chat_member(self, chat_id, user_id, **kwargs):
+        self.recorder.record('get_chat_member')
+        return SimpleNamespace(user=SimpleNamespace(id=int(user_id), first_name=f'User {user_id}'))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            self.recorder.record(name)
+            return FakeMessage(self, kwargs.get('chat_id', args[0] if args else None), **kwargs)
+        return method
+
+
+class FakeChat:
+    def __init__(self, bot: FakeBot, chat_id: int):
+        self.bot = bot
+        self.id = chat_id
+        self.type = 'supergroup'
+
+    def send_message(self, *args, **kwargs):
+        return self.bot.send_message(self.id, *args, **kwargs)
+
+    def send_photo(self, *args, **kwargs):
+        return self.bot.send_photo(self.id, *args, **kwargs)
+
+    def send_poll(self, *args, **kwargs):
+        return self.bot.send_poll(self.id, *args, **kwargs)
+
+    def get_member(self, user_id, **kwargs):
+        return self.bot.get_chat_member(self.id, user_id, **kwargs)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot: FakeBot, chat: FakeChat, data: str):
+        self.bot = bot
+        self.data = data
+        self.message = FakeMessage(bot, chat.id)
+
+    def answer(self, *args, **kwargs):
+        return self.bot.answer_callback_query(*args, **kwargs)
+
+    def edit_message_text(self, *args, **kwargs):
+        return self.bot.edit_message_text(*args, **kwargs)
+
+
+class FakeInlineQuery:
+    _ids = count(1)
+
+    def __init__(self, bot: FakeBot, user, query: str, offset: str = ''):
+        self.bot = bot
+        self.id = str(next(self._ids))
+        self.from_user = user
+        self.query = query
+        self.offset = offset
+
+    def answer(self, *args, **kwargs):
+        return self.bot.answer_inline_query(self.id, *args, **kwargs)
+
+
+_update_ids = count(1)
+
+
+def fake_update(bot: FakeBot, chat_id=None, user_id=1000, callback_data=None, inline_query=None):
+    user = SimpleNamespace(id=user_id, first_name=f'User {user_id}')
+    chat = FakeChat(bot, chat_id) if chat_id is not None else None
+    return SimpleNamespace(
+        update_id=next(_update_ids),
+        effective_chat=chat,
+        effective_user=user,
+        effective_message=FakeMessage(bot, chat_id),
+        callback_query=FakeCallbackQuery(bot, chat, callback_data) if callback_data is not None else None,
+        inline_query=FakeInlineQuery(bot, user, inline_query) if inline_query is not None else None
+    )
+
+
+def fake_context(bot: FakeBot, args=()):
+    return SimpleNamespace(bot=bot, args=list(args), job_queue=None)
+
+
+class FakeOpenLibrary:
+    """Replaces olclient's OpenLibrary in BookCache"""
+
+    def __init__(self, recorder: Recorder):
+        self.recorder = recorder
+
+    def get(self, olid):
+        self.recorder.record('openlibrary.get')
+        return SimpleNamespace(
+            olid=olid,
+            title=f'Book {olid}',
+            authors=[SimpleNamespace(name=f'Author of {olid}')],
+            description=f'Description of {olid}'
+        )
+
+
+class FakeResponse:
+    def __init__(self, data=None, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeHttp:
+    """Replaces the requests sessions used for OpenLibrary searches and cover checks"""
+
+    def __init__(self, recorder: Recorder, results: int = 100):
+        self.recorder = recorder
+        self.results = results
+
+    def get(self, url, params=None, **kwargs):
+        self.recorder.record('openlibrary.search')
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 20))
+        return FakeResponse({
+            'numFound': self.results,
+            'docs': [{
+                'key': f'/works/OL{i}W',
+                'title': f'{params.get("title")} {i}',
+                'author_name': [f'Author {i}'],
+                'cover_edition_key': f'OL{i}M'
+            } for i in range(offset, min(offset + limit, self.results))]
+        })
+
+    def head(self, url, **kwargs):
+        self.recorder.record('openlibrary.cover')
+        return FakeResponse()
@@ -0,0 +1,253 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from os import getenv
+from threading import Lock
+from typing import Optional, Iterable, Dict
+import logging
+import struct
+import zlib
+import requests
+from sqlalchemy.exc import SQLAlchemyError
+from cache import LRUCache
+from utils import utcnow
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BookInfo = namedtuple('BookInfo', ['olid', 'title', 'authors', 'description', 'cover_olid', 'cover_url', 'cover_exists', 'cover_file_id'])
+
+COVER_URL = 'https://covers.openlibrary.org/b/olid/{olid}-L.jpg'
+
+
+@lru_cache(maxsize=None)
+def placeholder_cover(width: int = 400, height: int = 600, shade: int = 0xd0) -> bytes:
+    """A plain grey PNG sent in place of covers OpenLibrary doesn't have"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    # Every row is filter type 0 followed by one 8 bit grey pixel per column
+    pixels = (b'\x00' + bytes([shade]) * width) * height
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(pixels, 9)),
+        chunk(b'IEND', b''),
+    ])
+
+
+class BookCache:
+    """
+    Book metadata lookups backed by an in-process LRU, the `book` table and finally OpenLibrary.
+    Only books that were never fetched wait for OpenLibrary. Rows older than `ttl` seconds are returned as they are
+    and refetched in the background, fetched books get their cover checked in the background too.
+    """
+
+    def __init__(self, model, session_factory, maxsize: int = 1024, ttl: float = 7 * 24 * 60 * 60):
+        self.model = model
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.db_hits = 0
+        self.fetches = 0
+        self.http = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='openlibrary')
+        # Refreshes, cover checks and the nightly batch, so lookups that have to wait for OpenLibrary never queue behind them
+        self.background = ThreadPoolExecutor(max_workers=4, thread_name_prefix='openlibrary-background')
+        self._openlibrary = None
+        # Telegram's file_id for the placeholder, once it has been uploaded
+        self.placeholder_file_id: Optional[str] = None
+        self._refreshing = set()
+        self._lock = Lock()
+
+    @property
+    def openlibrary(self):
+        """olclient is slow to import, so the client is only built once a book has to be fetched"""
+        with self._lock:
+            if self._openlibrary is None:
+                from olclient.openlibrary import OpenLibrary
+                self._openlibrary = OpenLibrary()
+            return self._openlibrary
+
+    @openlibrary.setter
+    def openlibrary(self, client) -> None:
+        self._openlibrary = client
+
+    def get(self, olid: str) -> Optional[BookInfo]:
+        return self.get_many([olid]).get(olid)
+
+    def get_many(self, olids: Iterable[str]) -> Dict[str, BookInfo]:
+        """Looks up several books with at most one query and one concurrent round of OpenLibrary requests"""
+        books = {}
+        missing = []
+        for olid in dict.fromkeys(olids):
+            book = self.memory.get(olid)
+            if book is not None:
+                books[olid] = book
+            else:
+                missing.append(olid)
+        if not missing:
+            return books
+        stale = []
+        session = self.session_factory()
+        try:
+            for row in session.query(self.model).filter(self.model.olid.in_(missing)):
+                self.db_hits += 1
+                books[row.olid] = self._to_info(row)
+                if not row.fetched_at or row.fetched_at <= utcnow() - timedelta(seconds=self.ttl):
+                    stale.append(row.olid)
+        finally:
+            session.close()
+        to_fetch = [olid for olid in missing if olid not in books]
+        fetched = self.pool.map(lambda olid: self._fetch(olid, None), to_fetch)
+        for olid, book in zip(to_fetch, fetched):
+            if book:
+                books[olid] = book
+        for olid in missing:
+            if olid in books:
+                self.memory.set(olid, books[olid])
+        for olid in stale:
+            self.refresh_in_background(olid, books[olid])
+        return books
+
+    def refresh_in_background(self, olid: str, stale: Optional[BookInfo] = None) -> None:
+        with self._lock:
+            if olid in self._refreshing:
+                return
+            self._refreshing.add(olid)
+        self.background.submit(self._refresh, olid, stale)
+
+    def refresh_stale(self, limit: int = 1000) -> int:
+        """Refetches up to `limit` of the stalest rows and rows whose cover was never checked, returns how many"""
+        session = self.session_factory()
+        try:
+            rows = session.query(self.model)\
+                .filter((self.model.fetched_at <= utcnow() - timedelta(seconds=self.ttl)) |
+                        self.model.fetched_at.is_(None) | self.model.cover_exists.is_(None))\
+                .order_by(self.model.fetched_at.nullsfirst())\
+                .limit(limit)\
+                .all()
+            stale = {row.olid: self._to_info(row) for row in rows}
+        finally:
+            session.close()
+        for olid, book in zip(stale, self.background.map(lambda olid: self._fetch(olid, stale[olid]), stale)):
+            if book:
+                self.memory.set(olid, book)
+        logger.info(f'Refreshed {len(stale)} books from OpenLibrary')
+        return len(stale)
+
+    def set_cover_file_id(self, olid: str, file_id: Optional[str]) -> None:
+        """Stores the file_id Telegram gave the book's cover, so it is sent by reference from then on"""
+        session = self.session_factory()
+        try:
+            session.query(self.model).filter(self.model.olid == olid).update({self.model.cover_file_id: file_id})
+            session.commit()
+        except SQLAlchemyError:
+            logger.exception(f'Storing the cover file_id of {olid} failed')
+            session.rollback()
+        finally:
+            session.close()
+        book = self.memory.get(olid)
+        if book:
+            self.memory.set(olid, book._replace(cover_file_id=file_id))
+
+    def _refresh(self, olid: str, stale: Optional[BookInfo]) -> None:
+        try:
+            book = self._fetch(olid, stale)
+            if book:
+                self.memory.set(olid, book)
+        finally:
+            with self._lock:
+                self._refreshing.discard(olid)
+
+    def _fetch(self, olid: str, stale: Optional[BookInfo]) -> Optional[BookInfo]:
+        """Fetches the book's metadata and stores it, the cover is checked by a separate background task"""
+        self.fetches += 1
+        try:
+            with metrics.openlibrary_call('get'):
+                book = self.openlibrary.get(olid)
+        except Exception:
+            logger.exception(f'Fetching {olid} from OpenLibrary failed')
+            return stale
+        if not book:
+            return None
+        description = getattr(book, 'description', None)
+        if isinstance(description, dict):
+            description = description.get('value')
+        info = BookInfo(
+            olid=olid,
+            title=book.title,
+            authors=tuple(a.name for a in getattr(book, 'authors', None) or []),
+            description=description,
+            cover_olid=str(book.olid),
+            cover_url=COVER_URL.format(olid=book.olid),
+            cover_exists=stale.cover_exists if stale and stale.cover_olid == str(book.olid) else None,
+            cover_file_id=stale.cover_file_id if stale and stale.cover_olid == str(book.olid) else None
+        )
+        session = self.session_factory()
+        try:
+            session.merge(self.model(
+                olid=info.olid,
+                title=info.title,
+                authors=list(info.authors),
+                description=info.description,
+                cover_olid=info.cover_olid,
+                cover_url=info.cover_url,
+                cover_exists=info.cover_exists,
+                cover_file_id=info.cover_file_id,
+                fetched_at=utcnow()
+            ))
+            session.commit()
+        except SQLAlchemyError:
+            # Another worker may have stored the same book concurrently, the fetched data is still good
+            logger.exception(f'Storing {olid} in the book table failed')
+            session.rollback()
+        finally:
+            session.close()
+        if info.cover_exists is None:
+            self.background.submit(self._check_cover, info)
+        return info
+
+    def _check_cover(self, info: BookInfo) -> None:
+        try:
+            with metrics.openlibrary_call('cover'):
+                # Without default=false a missing cover is a 200 with a blank image
+                response = self.http.head(info.cover_url, params={'default': 'false'}, allow_redirects=True, timeout=10)
+        except requests.RequestException:
+            logger.warning(f'Checking the cover of {info.olid} failed')
+            return
+        if response.status_code not in (200, 404):
+            return
+        exists = response.status_code == 200
+        session = self.session_factory()
+        try:
+            session.query(self.model).filter(self.model.olid == info.olid).update({self.model.cover_exists: exists})
+            session.commit()
+        except SQLAlchemyError:
+            logger.exception(f'Storing the cover of {info.olid} failed')
+            session.rollback()
+        finally:
+            session.close()
+        self.memory.set(info.olid, info._replace(cover_exists=exists))
+
+    @staticmethod
+    def _to_info(row) -> BookInfo:
+        return BookInfo(
+            olid=row.olid,
+            title=row.title,
+            authors=tuple(row.authors or ()),
+            description=row.description,
+            cover_olid=row.cover_olid,
+            cover_url=row.cover_url or (COVER_URL.format(olid=row.cover_olid) if row.cover_olid else None),
+            cover_exists=row.cover_exists,
+            cover_file_id=row.cover_file_id
+        )
+
+
+def book_cache_from_env(model, session_factory) -> BookCache:
+    return BookCache(
+        model,
+        session_factory,
+        maxsize=int(getenv('BOOK_CACHE_SIZE', 1024)),
+        ttl=float(getenv('BOOK_CACHE_TTL', 7 * 24 * 60 * 60))
+    )
@@ -1,77 +1,96 @@
+from time import perf_counter
+_started = perf_counter()
 from dotenv import load_dotenv
 load_dotenv()
 from os import getenv
-from db.models import session_creator, Session, Club, Admin, Suggestion, Meeting, ScheduledOffsetTask, ScheduledRepeatingTask
-from functools import wraps
+from db.models import session_scope, wait_for_database, try_advisory_lock, pool_stats, book_cache, rendered_meetings, Session, Club, Admin, Suggestion, Meeting, ScheduledOffsetTask, ScheduledRepeatingTask
+from scheduler import offset_tasks, repeating_tasks, repeating_actions
+from polls import open_suggestion_poll, open_polls, record_votes
+from db.query_stats import log_queries
+from sqlalchemy.orm import selectinload
+from clubs import clubs
+from outbox import outbox
+import metrics
+from concurrency import ChatSerialExecutor, in_chat_order, unordered
+from functools import wraps, partial
+from contextlib import contextmanager
+from typing import Iterator
 import logging
 from math import ceil
-from utils import format_date
-from dateutil.parser import parse, ParserError
-from dateutil.tz import gettz
+from utils import format_date, parse_date, is_timezone, to_utc, utcnow
+from dateutil.parser import ParserError
 from telegram import Update, ForceReply, ParseMode, InlineQueryResultArticle, InputTextMessageContent, InlineKeyboardButton, InlineKeyboardMarkup, error
-from telegram.ext import Updater, CommandHandler, InlineQueryHandler, Filters, CallbackContext, CallbackQueryHandler, MessageHandler
+from telegram import Bot
+from telegram.ext import Updater, CommandHandler, InlineQueryHandler, PollHandler, Filters, CallbackContext, CallbackQueryHandler, MessageHandler
 from telegram.utils.helpers import escape_markdown
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
 from durations import Duration
-import openlibrary as ol
-bookSearch = ol.BookSearch()
-from olclient.openlibrary import OpenLibrary
-openlibrary = OpenLibrary()
+from search import book_search, normalize_query
+from books import BookInfo, placeholder_cover
+from cache import LRUCache
+from time import sleep
+from threading import Event
+import signal
 from telegram_bot_pagination import InlineKeyboardPaginator
 
 
-tzinfos = {
-    "EST": gettz("America/New_York"),
-    "EDT": gettz("America/New_York"),
-    "CST": gettz("America/Chicago"),
-    "CDT": gettz("America/Chicago"),
-    "MST": gettz("America/Denver"),
-    "MDT": gettz("America/Denver"),
-    "PST": gettz("America/Los_Angeles"),
-    "PDT": gettz("America/Los_Angeles"),
-}
-
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
 )
 
 logger = logging.getLogger(__name__)
 
+# Seconds spent in each step of starting up, logged once the bot is running
+startup_timings = {'imports': perf_counter() - _started}
+
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = perf_counter() - started
+
+
+def only_in_group_with_club(func=None, *, load=()):
+    """`load` takes loader options for the Club relationships the handler uses"""
+    if func is None:
+        return partial(only_in_group_with_club, load=load)
 
-def only_in_group_with_club(func):
     @wraps(func)
     def wrapped(update, ctx, *args, **kwargs):
-        session = session_creator()
-        club = session.query(Club).filter_by(chat_id=str(update.effective_chat.id)).first()
-        if not club:
-            session.close()
+        info = clubs.get(update.effective_chat.id)
+        if not info:
             return
-        out = func(update, ctx, session, club, *args, **kwargs)
-        session.close()
-        return out
+        with session_scope() as session:
+            club = session.query(Club).options(*load).get(info.id)
+            if not club:
+                clubs.forget(update.effective_chat.id)
+                return
+            return func(update, ctx, session, club, *args, **kwargs)
     return wrapped
 
 
 def only_admin(func):
     @wraps(func)
     def wrapped(update: Update, ctx: CallbackContext, session: Session, club: Club, *args, **kwargs):
-        admins = [a.user_id for a in club.admins]
-        if str(update.effective_user.id) not in admins:
-            update.effective_chat.send_message('This command is for admins only!')
+        if str(update.effective_user.id) not in clubs.get(update.effective_chat.id).admin_ids:
+            outbox.send_message(update.effective_chat.id, 'This command is for admins only!')
             return
         return func(update, ctx, session, club, *args, **kwargs)
     return wrapped
 
 
 def create_club(update: Update, ctx: CallbackContext) -> None:
-    session = session_creator()
-    user = update.effective_user
-    club = Club(name=' '.join(ctx.args), chat_id=update.effective_chat.id)
-    session.add(club)
-    club.admins.append(Admin(user_id=user.id))
-    session.commit()
-    session.close()
-    update.effective_chat.send_message("Book club created!")
+    with session_scope() as session:
+        user = update.effective_user
+        club = Club(name=' '.join(ctx.args), chat_id=update.effective_chat.id)
+        session.add(club)
+        club.admins.append(Admin(user_id=user.id))
+        session.commit()
+        clubs.refresh(session, update.effective_chat.id)
+    outbox.send_message(update.effective_chat.id, "Book club created!")
 
 
 @only_in_group_with_club
@@ -81,7 +100,7 @@ def delete_club(update: Update, ctx: CallbackContext, session: Session, club: Cl
         InlineKeyboardButton("Yes", callback_data='dy'),
         InlineKeyboardButton("No", callback_data='dn')
     ]]
-    update.effective_chat.send_message(f'Are you sure you want to delete {club.name}?', reply_markup=InlineKeyboardMarkup(keyboard))
+    outbox.send_message(update.effective_chat.id, f'Are you sure you want to delete {club.name}?', reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 @only_in_group_with_club
@@ -89,14 +108,15 @@ def delete_club(update: Update, ctx: CallbackContext, session: Session, club: Cl
 def delete_confirm(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
     query = update.callback_query
     if query.data == 'dn':
-        update.effective_chat.send_message('Action cancelled!')
-        query.message.delete()
+        outbox.send_message(update.effective_chat.id, 'Action cancelled!')
+        outbox.delete(update.effective_chat.id, query.message.message_id)
         query.answer()
     elif query.data == 'dy':
         session.delete(club)
         session.commit()
-        update.effective_chat.send_message('Book club deleted!')
-        query.message.delete()
+        clubs.forget(update.effective_chat.id)
+        outbox.send_message(update.effective_chat.id, 'Book club deleted!')
+        outbox.delete(update.effective_chat.id, query.message.message_id)
         query.answer()
 
 
@@ -105,9 +125,10 @@ def delete_confirm(update: Update, ctx: CallbackContext, session: Session, club:
 def schedule_meeting(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
     date = None
     try:
-        date = parse(" ".join(ctx.args).upper(), tzinfos=tzinfos)
-    except ParserError:
-        update.effective_chat.send_message(
+        date = parse_date(" ".join(ctx.args), club.timezone)
+    except (ParserError, OverflowError):
+        outbox.send_message(
+            update.effective_chat.id,
             'I was unable to parse that date! Suggested format: `/schedule_meeting February 20th 6:30 pm CST`',
             parse_mode=ParseMode.MARKDOWN)
         return
@@ -117,7 +138,7 @@ def schedule_meeting(update: Update, ctx: CallbackContext, session: Session, clu
             InlineKeyboardButton("No", callback_data=f'sn')
         ]
     ]
-    update.effective_chat.send_message(f'Are you sure you want to schedule a meeting for {format_date(date)}?', reply_markup=InlineKeyboardMarkup(keyboard))
+    outbox.send_message(update.effective_chat.id, f'Are you sure you want to schedule a meeting for {format_date(date, club.timezone)}?', reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 @only_in_group_with_club
@@ -125,18 +146,34 @@ def schedule_meeting(update: Update, ctx: CallbackContext, session: Session, clu
 def schedule_confirm(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
     query = update.callback_query
     if query.data == 'sn':
-        update.effective_chat.send_message('Action cancelled!')
-        query.message.delete()
+        outbox.send_message(update.effective_chat.id, 'Action cancelled!')
+        outbox.delete(update.effective_chat.id, query.message.message_id)
         query.answer()
     elif query.data.startswith('sy'):
         date = datetime.fromisoformat(query.data.replace('sy', '', 1))
-        update.effective_chat.send_message(f'Meeting scheduled for {format_date(date)}!')
-        club.meetings.append(Meeting(date_time=date))
+        outbox.send_message(update.effective_chat.id, f'Meeting scheduled for {format_date(date, club.timezone)}!')
+        club.meetings.append(Meeting(date_time=to_utc(date)))
         session.commit()
-        query.message.delete()
+        offset_tasks.plan_club(session, club)
+        outbox.delete(update.effective_chat.id, query.message.message_id)
         query.answer()
 
 
+@only_in_group_with_club
+@only_admin
+def set_timezone(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
+    tz_name = ' '.join(ctx.args)
+    if not is_timezone(tz_name):
+        outbox.send_message(
+            update.effective_chat.id,
+            'I don\'t know that timezone! Use a name like `America/Chicago` or `Europe/Berlin`',
+            parse_mode=ParseMode.MARKDOWN)
+        return
+    club.timezone = tz_name
+    session.commit()
+    outbox.send_message(update.effective_chat.id, f'Timezone set to {tz_name}!')
+
+
 @only_in_group_with_club
 @only_admin
 def set_meeting_book(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
@@ -144,28 +181,27 @@ def set_meeting_book(update: Update, ctx: CallbackContext, session: Session, clu
     book_olid = ctx.args[1]
     if not book_olid.startswith('OL'):
         suggestion = session.query(Suggestion).get(book_olid)
-        if suggestion:
+        if suggestion and suggestion.club_id == club.id:
             book_olid = suggestion.book_olid
         else:
-            update.effective_chat.send_message(f"Suggestion {suggestion.id} not found")
+            outbox.send_message(update.effective_chat.id, f"Suggestion {book_olid} not found")
             return
     meeting = session.query(Meeting).get(meeting_id)
     if not meeting or meeting.club_id != club.id:
-        update.effective_chat.send_message('That meeting does not belong to this book club!')
+        outbox.send_message(update.effective_chat.id, 'That meeting does not belong to this book club!')
         return
-    book = openlibrary.get(book_olid)
+    book = book_cache.get(book_olid)
     if not book:
-        update.effective_chat.send_message(f'Book with OLID {book_olid} not found on OpenLibrary!')
+        outbox.send_message(update.effective_chat.id, f'Book with OLID {book_olid} not found on OpenLibrary!')
         return
     meeting.book_olid = book_olid
-    suggestions_of_book = session.query(Suggestion).filter_by(book_olid=book_olid)
-    for s in suggestions_of_book:
-        session.delete(s)
+    meeting.book_title = book.title
+    club.archive_suggestions_of(book_olid, book.title, meeting.id)
     session.commit()
-    update.effective_chat.send_message(f'''
+    outbox.send_message(update.effective_chat.id, f'''
 Book for meeting (id no. {meeting.id}) set to {book.title}!
 Don't forget to set the pages for this meeting with `/set_meeting_pages {meeting_id} [pages]`''',
-                                       parse_mode=ParseMode.MARKDOWN)
+                        parse_mode=ParseMode.MARKDOWN)
 
 
 @only_in_group_with_club
@@ -175,11 +211,11 @@ def set_meeting_pages(update: Update, ctx: CallbackContext, session: Session, cl
     pages = ' '.join(ctx.args[1:])
     meeting = session.query(Meeting).get(meeting_id)
     if not meeting or meeting.club_id != club.id:
-        update.effective_chat.send_message('That meeting does not belong to this book club!')
+        outbox.send_message(update.effective_chat.id, 'That meeting does not belong to this book club!')
         return
     meeting.book_pages = pages
     session.commit()
-    update.effective_chat.send_message(f'Pages for meeting (id no. {meeting.id}) set to {pages}!')
+    outbox.send_message(update.effective_chat.id, f'Pages for meeting (id no. {meeting.id}) set to {pages}!')
 
 
 @only_in_group_with_club
@@ -188,11 +224,12 @@ def delete_meeting(update: Update, ctx: CallbackContext, session: Session, club:
     meeting_id = ctx.args[0]
     meeting = session.query(Meeting).get(meeting_id)
     if not meeting or meeting.club_id != club.id:
-        update.effective_chat.send_message('That meeting does not belong to this book club!')
+        outbox.send_message(update.effective_chat.id, 'That meeting does not belong to this book club!')
         return
     session.delete(meeting)
     session.commit()
-    update.effective_chat.send_message('Meeting deleted!')
+    offset_tasks.plan_club(session, club)
+    outbox.send_message(update.effective_chat.id, 'Meeting deleted!')
 
 
 @only_in_group_with_club
@@ -204,13 +241,13 @@ def next_meeting(update: Update, ctx: CallbackContext, session: Session, club: C
         ]
     ]
     if not meeting:
-        update.effective_chat.send_message('''
+        outbox.send_message(update.effective_chat.id, '''
 No upcoming meetings are scheduled!
 To schedule a meeting use: `/schedule_meeting [date]`''', parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
         return
-    update.effective_chat.send_message(f'''
+    outbox.send_message(update.effective_chat.id, f'''
 Next meeting for {club.name}:
-{str(meeting)}''', parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+{meeting.render()}''', parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
 @only_in_group_with_club
@@ -221,42 +258,86 @@ def suggest(update: Update, ctx: CallbackContext, session: Session, club: Club)
         ]
     ]
     if len(ctx.args) == 0:
-        update.effective_chat.send_message('Click the button below to search for a book!', reply_markup=InlineKeyboardMarkup(keyboard))
-    suggestion = openlibrary.get(ctx.args[0])
+        outbox.send_message(update.effective_chat.id, 'Click the button below to search for a book!', reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    suggestion = book_cache.get(ctx.args[0])
     if not suggestion:
-        update.effective_chat.send_message("No book found with that ID - click the button below to search!", reply_markup=InlineKeyboardMarkup(keyboard))
+        outbox.send_message(update.effective_chat.id, "No book found with that ID - click the button below to search!", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
     club.suggestions.append(Suggestion(book_olid=str(suggestion.olid), suggested_by=str(update.effective_user.id)))
     session.commit()
-    update.effective_chat.send_photo(
-        photo=f'https://covers.openlibrary.org/b/olid/{suggestion.olid}-L.jpg',
-        caption=f'''
+    text = f'''
 {update.effective_user.first_name} suggested:
 
-[{escape_markdown(suggestion.title)}](https://openlibrary.org/books/{suggestion.olid}) by {', '.join([a.name for a in suggestion.authors])}
+[{escape_markdown(suggestion.title)}](https://openlibrary.org/books/{suggestion.olid}) by {', '.join(suggestion.authors)}
 
 {suggestion.description or ''}
-''', parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+'''
+    send_cover(update.effective_chat.id, suggestion, caption=text, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+# Fragments of the BadRequest messages Telegram answers with when the photo itself can't be used
+BAD_PHOTO_ERRORS = ('file identifier', 'http url', 'web page content', 'photo_invalid', 'image_process_failed')
+
+
+# Fragments of the BadRequest messages stop_poll answers with when the poll was already stopped or deleted
+GONE_POLL_ERRORS = ('poll has already been closed', 'message to stop not found', 'message_id_invalid')
+
+
+def is_bad_request(e: BaseException, fragments) -> bool:
+    return isinstance(e, error.BadRequest) and any(fragment in e.message.lower() for fragment in fragments)
+
+
+def send_cover(chat_id, book: BookInfo, placeholder: bool = False, **kwargs) -> None:
+    """
+    Sends the book's cover, by the file_id Telegram gave it if it was sent before so Telegram doesn't download it from
+    OpenLibrary again. Books without a cover, or whose cover can't be sent, get the placeholder instead.
+    """
+    placeholder = placeholder or book.cover_exists is False
+    if placeholder:
+        photo = book_cache.placeholder_file_id or placeholder_cover()
+    else:
+        photo = book.cover_file_id or book.cover_url
+
+    def sent(future):
+        e = future.exception()
+        if e:
+            # The outbox already logged it, only a rejected photo is worth retrying with the placeholder
+            if not placeholder and is_bad_request(e, BAD_PHOTO_ERRORS):
+                if book.cover_file_id:
+                    book_cache.background.submit(book_cache.set_cover_file_id, book.olid, None)
+                send_cover(chat_id, book, placeholder=True, **kwargs)
+            return
+        file_id = future.result().photo[-1].file_id
+        if placeholder:
+            book_cache.placeholder_file_id = file_id
+        elif file_id != book.cover_file_id:
+            book_cache.background.submit(book_cache.set_cover_file_id, book.olid, file_id)
+    outbox.send_photo(chat_id, photo=photo, **kwargs).add_done_callback(sent)
 
 
 @only_in_group_with_club
 @only_admin
 def delete_suggestion(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
-    suggestion = session.query(Suggestion).get(ctx.args[0])
-    session.delete(suggestion)
+    deleted = session.query(Suggestion)\
+        .filter(Suggestion.id == int(ctx.args[0]), Suggestion.club_id == club.id)\
+        .delete(synchronize_session=False)
     session.commit()
-    update.effective_chat.send_message("Suggestion deleted!")
+    outbox.send_message(update.effective_chat.id, "Suggestion deleted!" if deleted else 'That suggestion does not belong to this book club!')
 
 
 @only_in_group_with_club
 def suggestions(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
-    if len(club.suggestions) == 0:
-        update.effective_chat.send_message('There are no book suggestions!')
+    suggestion_count = club.count_suggestions()
+    if suggestion_count == 0:
+        outbox.send_message(update.effective_chat.id, 'There are no book suggestions!')
         return
     paginator = InlineKeyboardPaginator(
-        ceil(len(club.suggestions) / 4),
+        ceil(suggestion_count / 4),
         data_pattern='psug#{page}'
     )
-    update.effective_chat.send_message(
+    outbox.send_message(
+        update.effective_chat.id,
         club.get_chunked_suggestion_strs(update, 0),
         reply_markup=paginator.markup,
         parse_mode=ParseMode.MARKDOWN,
@@ -268,7 +349,7 @@ def suggestions_page_callback(update: Update, ctx: CallbackContext, session: Ses
     query = update.callback_query
     page = int(query.data.split('#')[1])
     paginator = InlineKeyboardPaginator(
-        ceil(len(club.suggestions) / 4),
+        ceil(club.count_suggestions() / 4),
         current_page=page,
         data_pattern='psug#{page}'
     )
@@ -282,115 +363,133 @@ def suggestions_page_callback(update: Update, ctx: CallbackContext, session: Ses
     query.answer()
 
 
+@only_in_group_with_club
+def past_picks(update: Update, ctx: CallbackContext, session: Session, club: Club) -> None:
+    picks = club.past_picks()
+    if not picks:
+        outbox.send_message(update.effective_chat.id, 'No suggested book has been picked for a meeting yet!')
+        return
+    pick_strs = [f'''
+- [{escape_markdown(p.book_title or p.book_olid)}](https://openlibrary.org/books/{p.book_olid}), picked {format_date(p.picked_at, club.timezone)}, suggested {p.suggestions} time{"s" if p.suggestions > 1 else ""}''' for p in picks]
+    outbox.send_message(update.effective_chat.id, f'''
+Past picks for {club.name}:
+{''.join(pick_strs)}''', parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+
+
 @only_in_group_with_club
 @only_admin
 def open_poll(update: Update, ctx: CallbackContext, session: Session, club: Club):
-    if club.poll_msg_id:
-        update.effective_chat.send_message(
-            'There can only be one active suggestion poll at a time. To close the current poll, use /close_poll')
-    candidates = club.pick_n_suggestions(10)
-    if len(candidates) < 2:
-        update.effective_chat.send_message('Too few suggestions to run a poll!')
-        return
-    options = set()
-    for candidate in candidates:
-        session.query(Suggestion).get(candidate.id).last_voted_on = datetime.now()
-        book = openlibrary.get(candidate.book_olid)
-        if book:
-            option = f'{book.title} ({book.olid})'
-            if len(option) > 100:
-                # 6 is length of space, parenthesis, and elipsis
-                option = f'{book.title[:-(100 - len(option) - len(book.olid) - 6)]}... ({book.olid})'
-            options.add(option)
-    poll = update.effective_chat.send_poll(
-        question=f'Vote for our next book!',
-        options=list(options),
-        allows_multiple_answers=True
-    )
-    club.poll_msg_id = poll.message_id
-    session.commit()
-    poll.pin()
+    problem = open_suggestion_poll(session, club)
+    if problem:
+        outbox.send_message(update.effective_chat.id, problem)
 
 
 @only_in_group_with_club
 @only_admin
 def close_poll(update: Update, ctx: CallbackContext, session: Session, club: Club):
-    if not club.poll_msg_id:
-        update.effective_chat.send_message(
-            'There is no poll currently active!'
+    active = open_polls(session, club)
+    if ctx.args:
+        active = [p for p in active if str(p.id) == ctx.args[0]]
+    if not active:
+        outbox.send_message(
+            update.effective_chat.id,
+            'There is no poll currently active!' if not ctx.args else f'There is no active poll {ctx.args[0]}!'
         )
         return
-    poll = ctx.bot.stop_poll(chat_id=update.effective_chat.id, message_id=int(club.poll_msg_id))
-    winner = poll.options[0]
-    for option in poll.options:
-        if option.voter_count > winner.voter_count:
-            winner = option
-    olid = winner.text.split(' ')[-1].replace('(', '').replace(')', '')
-    book = openlibrary.get(olid)
-    update.effective_chat.send_message(f'''
-Book selected: [{escape_markdown(book.title)}](https://openlibrary.org/books/{book.olid}) by {', '.join([a.name for a in book.authors])}
-{f"Set this as the book for the next meeting: `/smb {club.get_next_meeting().id} {book.olid}`" if club.get_next_meeting() else ""}
-''', reply_to_message_id=int(club.poll_msg_id), parse_mode=ParseMode.MARKDOWN)
-    club.poll_msg_id = None
+    poll = active[0]
+    try:
+        stopped = outbox.call('stop_poll', update.effective_chat.id, message_id=int(poll.message_id)).result()
+    except error.TelegramError as e:
+        if not is_bad_request(e, GONE_POLL_ERRORS):
+            outbox.send_message(update.effective_chat.id, f'I was unable to close the poll: {e.message}')
+            return
+        # Stopped or deleted in Telegram already, the stored counts are the last ones the bot saw
+        stopped = None
+    if stopped:
+        # The stopped poll has the final counts, vote updates may still be queued behind this handler
+        record_votes(session, stopped.id, [o.voter_count for o in stopped.options])
+    poll.closed_at = utcnow()
     session.commit()
+    winner = poll.winner()
+    book = book_cache.get(winner.book_olid)
+    outbox.send_message(update.effective_chat.id, f'''
+Book selected: [{escape_markdown(winner.book_title)}](https://openlibrary.org/books/{winner.book_olid}) by {', '.join(book.authors) if book else 'unknown'}
+{f"Set this as the book for the next meeting: `/smb {club.get_next_meeting().id} {winner.book_olid}`" if club.get_next_meeting() else ""}
+''', reply_to_message_id=int(poll.message_id), allow_sending_without_reply=True, parse_mode=ParseMode.MARKDOWN)
+
+
+@only_in_group_with_club
+def polls(update: Update, ctx: CallbackContext, session: Session, club: Club):
+    active = open_polls(session, club)
+    if not active:
+        outbox.send_message(update.effective_chat.id, 'There is no poll currently active!')
+        return
+    poll_strs = []
+    for poll in active:
+        option_strs = ''.join(f'''
+    {option.voter_count} - {escape_markdown(option.book_title)}''' for option in sorted(poll.options, key=lambda o: -o.voter_count))
+        poll_strs.append(f'''
+Poll {poll.id}, opened {format_date(poll.opened_at, club.timezone)}:{option_strs}
+    Close this poll: `/close_poll {poll.id}`''')
+    outbox.send_message(update.effective_chat.id, ''.join(poll_strs), parse_mode=ParseMode.MARKDOWN)
+
+
+def poll_update(update: Update, ctx: CallbackContext) -> None:
+    with session_scope() as session:
+        record_votes(session, update.poll.id, [o.voter_count for o in update.poll.options])
+
+
+# Latest inline query id per user, used to drop queries superseded by a newer keystroke
+latest_inline_queries = LRUCache(maxsize=4096, ttl=60)
+INLINE_DEBOUNCE_SECONDS = float(getenv('INLINE_DEBOUNCE_SECONDS', 0.3))
 
 
 def inlinequery(update: Update, ctx: CallbackContext) -> None:
-    query = update.inline_query.query
-    if query == "":
-        update.inline_query.answer(results=[])
+    inline_query = update.inline_query
+    query = normalize_query(inline_query.query)
+    if len(query) < 3:
+        inline_query.answer(results=[], cache_time=300)
         return
+    offset = int(inline_query.offset or 0)
+    if book_search.cached(query, offset) is None:
+        latest_inline_queries.set(inline_query.from_user.id, inline_query.id)
+        sleep(INLINE_DEBOUNCE_SECONDS)
+        if latest_inline_queries.get(inline_query.from_user.id) != inline_query.id:
+            return
+    books, next_offset = book_search.search(query, offset)
     results = [
         InlineQueryResultArticle(
             id=book.key,
             title=book.title,
-            description=f'By {book.author if type(book.author) is not list else ", ".join(book.author)}',
+            description=f'By {", ".join(book.authors)}',
             thumb_url=f'https://covers.openlibrary.org/b/olid/{book.cover_edition_key}-M.jpg',
             input_message_content=InputTextMessageContent(message_text=f'/suggest {book.cover_edition_key}')
-        ) for book in bookSearch.get_by_title(query)]
-    update.inline_query.answer(results[:20])
-
-
-def check_offset_tasks(ctx: CallbackContext) -> None:
-    session = session_creator()
-    clubs = session.query(Club).all()
-    for club in clubs:
-        next_meeting = club.get_next_meeting()
-        if next_meeting and next_meeting.date_time:
-            for task in club.scheduled_offset_tasks:
-                if next_meeting not in task.run_on_meetings:
-                    earliest_proc = next_meeting.date_time.timestamp() - Duration(task.when).to_seconds()
-                    if earliest_proc <= datetime.now().timestamp() and datetime.now().timestamp() - earliest_proc < 60 * 60:
-                        if task.action == 'nag':
-                            parsed_durations = Duration(task.when).parsed_durations
-                            time_until = ', '.join([f'{d.value:g} {d.scale.representation.long_plural if d.value > 1 else d.scale.representation.long_singular}' for d in parsed_durations])
-                            keyboard = [
-                                [
-                                    InlineKeyboardButton("Suggest a book", switch_inline_query_current_chat='')
-                                ]
-                            ]
-                            msg = ctx.bot.send_message(chat_id=club.chat_id, text=f'''
-Reminder: {club.name} is meeting {f"in {time_until}" if earliest_proc != next_meeting.date_time.timestamp() else "now"}!
-{str(next_meeting)}''', parse_mode=ParseMode.MARKDOWN, keyboard=InlineKeyboardMarkup(keyboard))
-                            try:
-                                msg.pin()
-                            except:
-                                pass
-                        task.run_on_meetings.append(next_meeting)
-                        session.commit()
+        ) for book in books]
+    inline_query.answer(
+        results,
+        cache_time=300,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset is not None else ''
+    )
 
 
 @only_in_group_with_club
 @only_admin
 def schedule_offset_task(update: Update, ctx: CallbackContext, session: Session, club: Club):
     action = ctx.args[0]
-    when = ctx.args[1]
-    club.scheduled_offset_tasks.append(ScheduledOffsetTask(action=action, when=when))
-    session.commit()
-    update.effective_chat.send_message('Scheduled!')
+    when = ' '.join(ctx.args[1:])
+    try:
+        offset_seconds = int(Duration(when).to_seconds())
+    except Exception:
+        outbox.send_message(update.effective_chat.id, f'I was unable to parse {when} as a duration!')
+        return
+    task = ScheduledOffsetTask(action=action, when=when, offset_seconds=offset_seconds)
+    club.scheduled_offset_tasks.append(task)
+    offset_tasks.plan_task(session, task)
+    outbox.send_message(update.effective_chat.id, 'Scheduled!')
 
 
-@only_in_group_with_club
+@only_in_group_with_club(load=[selectinload(Club.scheduled_offset_tasks)])
 @only_admin
 def scheduled_tasks(update: Update, ctx: CallbackContext, session: Session, club: Club):
     task_strs = []
@@ -398,7 +497,7 @@ def scheduled_tasks(update: Update, ctx: CallbackContext, session: Session, club
         task_strs.append(f'''
 {task.action} {task.when} before meeting
     Delete this task: `/delete_offset_task {task.id}`''')
-    update.effective_chat.send_message(f'''
+    outbox.send_message(update.effective_chat.id, f'''
 Scheduled tasks for {club.name}:
 {''.join(task_strs)}''', parse_mode=ParseMode.MARKDOWN)
 
@@ -407,12 +506,74 @@ Scheduled tasks for {club.name}:
 @only_admin
 def delete_offset_task(update: Update, ctx: CallbackContext, session: Session, club: Club):
     task = session.query(ScheduledOffsetTask).get(ctx.args[0])
-    if not task or task not in club.scheduled_offset_tasks:
-        update.effective_chat.send_message('That task does not belong to this book club!')
+    if not task or task.club_id != club.id:
+        outbox.send_message(update.effective_chat.id, 'That task does not belong to this book club!')
         return
     session.delete(task)
     session.commit()
-    update.effective_chat.send_message('Task deleted!')
+    outbox.send_message(update.effective_chat.id, 'Task deleted!')
+
+
+# Shortest interval a repeating task may use, so a typo can't make the bot spam a group
+MIN_REPEAT_INTERVAL = timedelta(hours=1)
+
+
+@only_in_group_with_club
+@only_admin
+def schedule_repeating_task(update: Update, ctx: CallbackContext, session: Session, club: Club):
+    action = ctx.args[0] if ctx.args else ''
+    if action not in repeating_actions:
+        outbox.send_message(
+            update.effective_chat.id,
+            f'Usage: `/schedule_repeating_task [{"|".join(repeating_actions)}] [interval] from [first date]`, e.g. '
+            f'`/schedule_repeating_task nag 1 week from Sunday 6 pm`',
+            parse_mode=ParseMode.MARKDOWN)
+        return
+    when, _, first = ' '.join(ctx.args[1:]).partition(' from ')
+    try:
+        interval_seconds = int(Duration(when).to_seconds())
+    except Exception:
+        outbox.send_message(update.effective_chat.id, f'I was unable to parse {when} as a duration!')
+        return
+    if interval_seconds < MIN_REPEAT_INTERVAL.total_seconds():
+        outbox.send_message(update.effective_chat.id, 'Repeating tasks can run at most once an hour!')
+        return
+    next_run_at = None
+    if first:
+        try:
+            next_run_at = to_utc(parse_date(first, club.timezone))
+        except (ParserError, OverflowError):
+            outbox.send_message(update.effective_chat.id, f'I was unable to parse {first} as a date!')
+            return
+    task = ScheduledRepeatingTask(action=action, when=when, interval_seconds=interval_seconds, next_run_at=next_run_at)
+    club.scheduled_repeating_tasks.append(task)
+    repeating_tasks.plan_task(session, task)
+    outbox.send_message(update.effective_chat.id, f'Scheduled! First run: {format_date(task.next_run_at, club.timezone)}')
+
+
+@only_in_group_with_club(load=[selectinload(Club.scheduled_repeating_tasks)])
+@only_admin
+def list_repeating_tasks(update: Update, ctx: CallbackContext, session: Session, club: Club):
+    task_strs = []
+    for task in club.scheduled_repeating_tasks:
+        task_strs.append(f'''
+{task.action} every {task.when}, next on {format_date(task.next_run_at, club.timezone) if task.next_run_at else 'never'}
+    Delete this task: `/delete_repeating_task {task.id}`''')
+    outbox.send_message(update.effective_chat.id, f'''
+Repeating tasks for {club.name}:
+{''.join(task_strs)}''', parse_mode=ParseMode.MARKDOWN)
+
+
+@only_in_group_with_club
+@only_admin
+def delete_repeating_task(update: Update, ctx: CallbackContext, session: Session, club: Club):
+    task = session.query(ScheduledRepeatingTask).get(ctx.args[0])
+    if not task or task.club_id != club.id:
+        outbox.send_message(update.effective_chat.id, 'That task does not belong to this book club!')
+        return
+    session.delete(task)
+    session.commit()
+    outbox.send_message(update.effective_chat.id, 'Task deleted!')
 
 
 @only_in_group_with_club
@@ -422,57 +583,160 @@ def add_admin(update: Update, ctx: CallbackContext, session: Session, club: Club
     try:
         user = update.effective_chat.get_member(ctx.args[0])
     except error.BadRequest:
-        update.effective_chat.send_message(f'User with telegram ID {ctx.args[0]} not found!')
+        outbox.send_message(update.effective_chat.id, f'User with telegram ID {ctx.args[0]} not found!')
+        return
+    if str(user.user.id) in clubs.get(update.effective_chat.id).admin_ids:
+        outbox.send_message(update.effective_chat.id, f'That person is already an admin!')
         return
-    admins = [a.user_id for a in club.admins]
-    if str(user.user.id) in admins:
-        update.effective_chat.send_message(f'That person is already an admin!')
     club.admins.append(Admin(user_id=user.user.id))
     session.commit()
-    update.effective_chat.send_message(f'Added {user.user.first_name} as an admin!')
+    clubs.refresh(session, update.effective_chat.id)
+    outbox.send_message(update.effective_chat.id, f'Added {user.user.first_name} as an admin!')
 
 
 def get_id(update: Update, ctx: CallbackContext):
     if not update.effective_message.reply_to_message:
-        update.effective_chat.send_message('Must be sent as a reply to a messsage!')
+        outbox.send_message(update.effective_chat.id, 'Must be sent as a reply to a messsage!')
         return
     user = update.effective_message.reply_to_message.from_user
-    update.effective_chat.send_message(f'Telegram user ID of {user.first_name} is {user.id}')
+    outbox.send_message(update.effective_chat.id, f'Telegram user ID of {user.first_name} is {user.id}')
 
 
 filters = Filters.chat_type.group | Filters.chat_type.supergroup
 
 
-def main() -> None:
-    updater = Updater(getenv("BOT_TOKEN"))
+handler_executor = ChatSerialExecutor(int(getenv("HANDLER_WORKERS", 8)))
+# Inline queries wait out INLINE_DEBOUNCE_SECONDS, so they get their own threads rather than holding up commands
+inline_executor = ChatSerialExecutor(int(getenv("INLINE_WORKERS", 4)))
+
+
+def build_updater() -> Updater:
+    request = metrics.CountingRequest(con_pool_size=int(getenv("TELEGRAM_CON_POOL_SIZE", 16)))
+    updater = Updater(bot=Bot(getenv("BOT_TOKEN"), request=request))
     dispatcher = updater.dispatcher
-    dispatcher.add_handler(CommandHandler(["create", "create_club"], create_club, filters=filters))
-    dispatcher.add_handler(CommandHandler(["delete", "delete_club"], delete_club, filters=filters))
-    dispatcher.add_handler(CommandHandler("suggest", suggest, filters=filters))
-    dispatcher.add_handler(CommandHandler("suggestions", suggestions, filters=filters))
-    dispatcher.add_handler(CommandHandler("schedule_meeting", schedule_meeting, filters=filters))
-    dispatcher.add_handler(CommandHandler(["meeting", "next_meeting"], next_meeting, filters=filters))
-    dispatcher.add_handler(CommandHandler(["set_meeting_book", "smb"], set_meeting_book, filters=filters))
-    dispatcher.add_handler(CommandHandler(["set_meeting_pages", "smp"], set_meeting_pages, filters=filters))
-    dispatcher.add_handler(CommandHandler("delete_meeting", delete_meeting, filters=filters))
-    dispatcher.add_handler(CommandHandler(["delete_suggestion", "ds"], delete_suggestion, filters=filters))
-    dispatcher.add_handler(CommandHandler("open_poll", open_poll, filters=filters))
-    dispatcher.add_handler(CommandHandler("close_poll", close_poll, filters=filters))
-    dispatcher.add_handler(CommandHandler("schedule_offset_task", schedule_offset_task, filters=filters))
-    dispatcher.add_handler(CommandHandler("scheduled_tasks", scheduled_tasks, filters=filters))
-    dispatcher.add_handler(CommandHandler("delete_offset_task", delete_offset_task, filters=filters))
-    dispatcher.add_handler(CommandHandler("add_admin", add_admin, filters=filters))
-    dispatcher.add_handler(CommandHandler("get_id", get_id, filters=filters))
-    dispatcher.add_handler(CallbackQueryHandler(schedule_confirm, pattern=r's.*'))
-    dispatcher.add_handler(CallbackQueryHandler(delete_confirm, pattern=r'd.*'))
-    dispatcher.add_handler(CallbackQueryHandler(suggestions_page_callback, pattern=r'^psug#'))
-    dispatcher.add_handler(InlineQueryHandler(inlinequery))
-    updater.job_queue.run_repeating(
-        callback=check_offset_tasks, interval=60
-    )
+    ordered = lambda handler: in_chat_order(handler_executor, metrics.instrument(log_queries(handler)))
+    dispatcher.add_handler(CommandHandler(["create", "create_club"], ordered(create_club), filters=filters))
+    dispatcher.add_handler(CommandHandler(["delete", "delete_club"], ordered(delete_club), filters=filters))
+    dispatcher.add_handler(CommandHandler("suggest", ordered(suggest), filters=filters))
+    dispatcher.add_handler(CommandHandler("suggestions", ordered(suggestions), filters=filters))
+    dispatcher.add_handler(CommandHandler("schedule_meeting", ordered(schedule_meeting), filters=filters))
+    dispatcher.add_handler(CommandHandler("set_timezone", ordered(set_timezone), filters=filters))
+    dispatcher.add_handler(CommandHandler(["meeting", "next_meeting"], ordered(next_meeting), filters=filters))
+    dispatcher.add_handler(CommandHandler(["set_meeting_book", "smb"], ordered(set_meeting_book), filters=filters))
+    dispatcher.add_handler(CommandHandler(["set_meeting_pages", "smp"], ordered(set_meeting_pages), filters=filters))
+    dispatcher.add_handler(CommandHandler("delete_meeting", ordered(delete_meeting), filters=filters))
+    dispatcher.add_handler(CommandHandler(["delete_suggestion", "ds"], ordered(delete_suggestion), filters=filters))
+    dispatcher.add_handler(CommandHandler("past_picks", ordered(past_picks), filters=filters))
+    dispatcher.add_handler(CommandHandler("open_poll", ordered(open_poll), filters=filters))
+    dispatcher.add_handler(CommandHandler("close_poll", ordered(close_poll), filters=filters))
+    dispatcher.add_handler(CommandHandler("polls", ordered(polls), filters=filters))
+    dispatcher.add_handler(CommandHandler("schedule_offset_task", ordered(schedule_offset_task), filters=filters))
+    dispatcher.add_handler(CommandHandler("scheduled_tasks", ordered(scheduled_tasks), filters=filters))
+    dispatcher.add_handler(CommandHandler("delete_offset_task", ordered(delete_offset_task), filters=filters))
+    dispatcher.add_handler(CommandHandler("schedule_repeating_task", ordered(schedule_repeating_task), filters=filters))
+    dispatcher.add_handler(CommandHandler("repeating_tasks", ordered(list_repeating_tasks), filters=filters))
+    dispatcher.add_handler(CommandHandler("delete_repeating_task", ordered(delete_repeating_task), filters=filters))
+    dispatcher.add_handler(CommandHandler("add_admin", ordered(add_admin), filters=filters))
+    dispatcher.add_handler(CommandHandler("get_id", ordered(get_id), filters=filters))
+    dispatcher.add_handler(CallbackQueryHandler(ordered(schedule_confirm), pattern=r's.*'))
+    dispatcher.add_handler(CallbackQueryHandler(ordered(delete_confirm), pattern=r'd.*'))
+    dispatcher.add_handler(CallbackQueryHandler(ordered(suggestions_page_callback), pattern=r'^psug#'))
+    dispatcher.add_handler(PollHandler(ordered(poll_update)))
+    dispatcher.add_handler(InlineQueryHandler(unordered(inline_executor, metrics.instrument(log_queries(inlinequery)))))
+    return updater
+
+
+def refresh_books(ctx: CallbackContext) -> None:
+    with metrics.observe('refresh_books'), session_scope() as session:
+        # Held while refreshing, so only one of several bot processes does it
+        if try_advisory_lock(session, 'refresh_books'):
+            book_cache.refresh_stale(int(getenv("BOOK_REFRESH_BATCH", 1000)))
+
+
+def register_gauges() -> None:
+    for lane in ('interactive', 'bulk', 'in_flight'):
+        metrics.gauge(f'bot_outbox_{lane}', f'Outbox calls {lane.replace("_", " ")}', lambda lane=lane: outbox.depth()[lane])
+    for stat in ('size', 'checked_in', 'checked_out', 'overflow'):
+        metrics.gauge(f'bot_db_pool_{stat}', f'Connection pool {stat.replace("_", " ")}', lambda stat=stat: pool_stats()[stat])
+    for name, cache in (('book', book_cache.memory), ('search', book_search.pages), ('meeting_render', rendered_meetings)):
+        metrics.gauge(f'bot_{name}_cache_hits', f'{name} cache hits', lambda cache=cache: cache.hits)
+        metrics.gauge(f'bot_{name}_cache_misses', f'{name} cache misses', lambda cache=cache: cache.misses)
+        metrics.gauge(f'bot_{name}_cache_size', f'{name} cache entries', lambda cache=cache: len(cache))
+    metrics.gauge('bot_book_db_hits', 'Books found in the book table after missing the cache', lambda: book_cache.db_hits)
+    metrics.gauge('bot_book_fetches', 'Books fetched from OpenLibrary', lambda: book_cache.fetches)
+
+
+def start_services(updater: Updater, worker: int = 0) -> None:
+    """
+    Every process runs the schedulers, due tasks are claimed with row locks so each one runs once. With more than one
+    process they also poll for tasks planned elsewhere.
+    """
+    with startup_phase('database'):
+        wait_for_database(float(getenv("DB_CONNECT_TIMEOUT", 30)))
+    with startup_phase('clubs'):
+        clubs.load()
+    # Telegram's global limit is per bot, so each sending process gets an equal share of it
+    processes = int(getenv("TELEGRAM_PROCESSES", getenv("WEBHOOK_WORKERS", 1)))
+    if processes > 1:
+        outbox.configure(outbox.global_rate / processes, outbox.chat_rate, outbox.chat_burst)
+    outbox.start(updater.bot)
+    with startup_phase('metrics'):
+        # Job processes usually run next to the one receiving updates, so they don't take its port
+        metrics.serve(worker, 'JOBS_METRICS_PORT' if getenv("UPDATE_MODE") == "jobs" else 'METRICS_PORT')
+        register_gauges()
+    multiple_processes = int(getenv("WEBHOOK_WORKERS", 1)) > 1 or getenv("UPDATE_MODE") == "jobs"
+    poll_interval = float(getenv("SCHEDULER_POLL_INTERVAL", 30 if multiple_processes else 0)) or None
+    with startup_phase('schedulers'):
+        offset_tasks.start(updater.job_queue, poll_interval=poll_interval)
+        repeating_tasks.start(updater.job_queue, poll_interval=poll_interval)
+    updater.job_queue.run_daily(refresh_books, time=time.fromisoformat(getenv("BOOK_REFRESH_TIME", "04:00")))
+    if getenv("DB_POOL_STATS_INTERVAL"):
+        updater.job_queue.run_repeating(
+            callback=lambda ctx: logger.info(f'Connection pool: {pool_stats()}'),
+            interval=int(getenv("DB_POOL_STATS_INTERVAL"))
+        )
+    logger.info(f'Worker {worker} started in {sum(startup_timings.values()):.2f}s: '
+                + ', '.join(f'{name} {seconds * 1000:.0f}ms' for name, seconds in startup_timings.items()))
+
+
+def stop_services(updater: Updater) -> None:
+    updater.job_queue.stop()
+    updater.dispatcher.stop()
+    handler_executor.shutdown()
+    inline_executor.shutdown()
+    outbox.drain(timeout=10)
+
+
+def run_jobs() -> None:
+    """Runs the scheduled jobs without receiving updates, next to a process that does"""
+    updater = build_updater()
+    start_services(updater)
+    updater.job_queue.start()
+    stopping = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+    stopping.wait()
+    stop_services(updater)
+
+
+def main() -> None:
+    mode = getenv("UPDATE_MODE", "polling")
+    if mode == "webhook":
+        import webhook
+        webhook.serve(build_updater, start_services, stop_services)
+        return
+    if mode == "jobs":
+        run_jobs()
+        return
+    with startup_phase('updater'):
+        updater = build_updater()
+    start_services(updater)
     updater.start_polling()
     updater.idle()
+    handler_executor.shutdown()
+    inline_executor.shutdown()
+    outbox.drain(timeout=10)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
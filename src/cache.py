@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+_missing = object()
+
+
+class LRUCache:
+    """Thread safe LRU cache with an optional per entry TTL (in seconds)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is not _missing:
+                value, expires_at = entry
+                if expires_at is None or expires_at > monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, monotonic() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _missing)
+            return default if entry is _missing else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,53 @@
+from collections import namedtuple
+from threading import Lock
+from typing import Optional
+from sqlalchemy.orm import selectinload
+from db.models import session_scope, Session, Club
+
+ClubInfo = namedtuple('ClubInfo', ['id', 'name', 'admin_ids'])
+
+
+def _club_info(club: Club) -> ClubInfo:
+    return ClubInfo(id=club.id, name=club.name, admin_ids=frozenset(a.user_id for a in club.admins))
+
+
+class ClubRegistry:
+    """
+    Process local map of chat id to club id, name and admin user ids, loaded in one query on first use.
+    Must be refreshed whenever a club is created or deleted or its admins change.
+    """
+
+    def __init__(self):
+        self._clubs = None
+        self._lock = Lock()
+
+    def get(self, chat_id) -> Optional[ClubInfo]:
+        if self._clubs is None:
+            self.load()
+        return self._clubs.get(str(chat_id))
+
+    def load(self) -> None:
+        with self._lock, session_scope() as session:
+            self._clubs = {
+                club.chat_id: _club_info(club)
+                for club in session.query(Club).options(selectinload(Club.admins))
+            }
+
+    def refresh(self, session: Session, chat_id) -> None:
+        club = session.query(Club).options(selectinload(Club.admins)).filter_by(chat_id=str(chat_id)).first()
+        if self._clubs is None:
+            self.load()
+        with self._lock:
+            if club:
+                self._clubs[str(chat_id)] = _club_info(club)
+            else:
+                self._clubs.pop(str(chat_id), None)
+
+    def forget(self, chat_id) -> None:
+        if self._clubs is None:
+            return
+        with self._lock:
+            self._clubs.pop(str(chat_id), None)
+
+
+clubs = ClubRegistry()
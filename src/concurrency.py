@@ -0,0 +1,76 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from threading import Lock
+import logging
+from telegram import Update
+from telegram.ext import CallbackContext
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSerialExecutor:
+    """
+    Runs handlers on a thread pool. Callbacks submitted with the same key run one at a time in submission order,
+    so a chat's confirm callbacks never overtake the command that produced them, while other chats proceed concurrently.
+    """
+
+    def __init__(self, workers: int = 8):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self._queues = {}
+        self._lock = Lock()
+
+    def submit(self, key, fn, *args) -> None:
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append((fn, args))
+                return
+            self._queues[key] = deque([(fn, args)])
+        self.pool.submit(self._drain, key)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=True)
+
+    def _drain(self, key) -> None:
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                fn, args = queue.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception(f'Handler {getattr(fn, "__name__", fn)} failed')
+
+
+def chat_key(update: Update):
+    if update.effective_chat:
+        return 'chat', update.effective_chat.id
+    if update.effective_user:
+        return 'user', update.effective_user.id
+    if update.poll:
+        return 'poll', update.poll.id
+    return 'update', update.update_id
+
+
+def in_chat_order(executor: ChatSerialExecutor, func):
+    """Hands the update off to the executor, serialized with the other updates of the same chat"""
+    @wraps(func)
+    def wrapped(update: Update, ctx: CallbackContext):
+        executor.submit(chat_key(update), func, update, ctx)
+    return wrapped
+
+
+def unordered(executor: ChatSerialExecutor, func):
+    """Hands the update off to the executor without any ordering guarantees"""
+    @wraps(func)
+    def wrapped(update: Update, ctx: CallbackContext):
+        executor.submit(('update', update.update_id), func, update, ctx)
+    return wrapped
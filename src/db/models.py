@@ -1,17 +1,22 @@
 from os import getenv
 
 from sqlalchemy import *
+from sqlalchemy import event
 from sqlalchemy.engine.url import URL
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from datetime import datetime
-from typing import Optional
-import random
-from olclient.openlibrary import OpenLibrary
-openlibrary = OpenLibrary()
+from sqlalchemy.orm import sessionmaker, Session, relationship, object_session
+from typing import Optional, Iterator
+from contextlib import contextmanager
+from time import monotonic, sleep
+from zlib import crc32
+from sqlalchemy.exc import OperationalError
+from db import query_stats
+from books import book_cache_from_env
+from members import member_names
+from cache import LRUCache
 from telegram import Update
 from telegram.utils.helpers import escape_markdown
-from utils import format_date
+from utils import format_date, utcnow, DEFAULT_TIMEZONE
 
 postgres_db = {
     "drivername": "postgresql",
@@ -21,25 +26,53 @@ postgres_db = {
     "host": getenv("DB_HOST"),
     "port": 5432
 }
-postgres_url = URL(**postgres_db)
-engine = create_engine(postgres_url)
+postgres_url = URL.create(**postgres_db)
+engine = create_engine(
+    postgres_url,
+    pool_size=int(getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(getenv("DB_MAX_OVERFLOW", 10)),
+    pool_pre_ping=getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    pool_recycle=int(getenv("DB_POOL_RECYCLE", 1800))
+)
+query_stats.install(engine)
 metadata = MetaData()
+rendered_meetings = LRUCache(maxsize=int(getenv("MEETING_RENDER_CACHE_SIZE", 4096)))
 
-Base = declarative_base(bind=engine, metadata=metadata)
+Base = declarative_base(metadata=metadata)
 
 
 task_to_meeting_table = Table('association', Base.metadata,
-                              Column('scheduled_offset_task_id', ForeignKey('scheduled_offset_task.id')),
-                              Column('meeting_id', ForeignKey('meeting.id'))
+                              Column('scheduled_offset_task_id', ForeignKey('scheduled_offset_task.id'), primary_key=True),
+                              Column('meeting_id', ForeignKey('meeting.id'), primary_key=True, index=True)
                               )
+
+
+class Book(Base):
+    __tablename__ = "book"
+
+    olid = Column(String, primary_key=True)
+    title = Column(String)
+    authors = Column(ARRAY(String))
+    description = Column(Text)
+    cover_olid = Column(String)
+    cover_url = Column(String)
+    cover_exists = Column(Boolean)
+    cover_file_id = Column(String)
+    fetched_at = Column(DateTime, index=True)
+
+
 class ScheduledOffsetTask(Base):
     __tablename__ = "scheduled_offset_task"
 
     id = Column(Integer, primary_key=True)
-    club_id = Column(Integer, ForeignKey("club.id"))
+    club_id = Column(Integer, ForeignKey("club.id"), index=True)
     club = relationship("Club", back_populates="scheduled_offset_tasks")
     action = Column(String)
     when = Column(String)
+    offset_seconds = Column(Integer)
+    next_meeting_id = Column(Integer, ForeignKey("meeting.id", ondelete="SET NULL"), index=True)
+    next_meeting = relationship("Meeting", foreign_keys=[next_meeting_id])
+    next_run_at = Column(DateTime, index=True)
     run_on_meetings = relationship("Meeting", secondary=task_to_meeting_table, back_populates="complete_offset_tasks")
 
 
@@ -47,10 +80,12 @@ class ScheduledRepeatingTask(Base):
     __tablename__ = "scheduled_repeating_task"
 
     id = Column(Integer, primary_key=True)
-    club_id = Column(Integer, ForeignKey("club.id"))
+    club_id = Column(Integer, ForeignKey("club.id"), index=True)
     club = relationship("Club", back_populates="scheduled_repeating_tasks")
     action = Column(String)
     when = Column(String)
+    interval_seconds = Column(Integer)
+    next_run_at = Column(DateTime, index=True)
 
 
 class Meeting(Base):
@@ -61,14 +96,27 @@ class Meeting(Base):
     club = relationship("Club", back_populates="meetings")
     date_time = Column(DateTime)
     book_olid = Column(String)
+    book_title = Column(String)
     book_pages = Column(String)
     complete_offset_tasks = relationship("ScheduledOffsetTask", secondary=task_to_meeting_table, back_populates="run_on_meetings")
 
-    def __str__(self):
-        book = openlibrary.get(self.book_olid) if self.book_olid else None
+    __table_args__ = (
+        Index('ix_meeting_club_id_date_time', 'club_id', 'date_time'),
+    )
+
+    def render(self) -> str:
+        """Markdown for the meeting, from its own columns only. Cached by everything that goes into it"""
+        key = (self.id, self.date_time, self.book_olid, self.book_title, self.book_pages, self.club.timezone)
+        text = rendered_meetings.get(key)
+        if text is None:
+            text = self._render()
+            rendered_meetings.set(key, text)
+        return text
+
+    def _render(self) -> str:
         return f'''
-{format_date(self.date_time) if self.date_time else 'Date TBA'}
-Book: {f"[{escape_markdown(book.title)}](https://openlibrary.org/books/{book.olid}/)" if book else 'TBA'}
+{format_date(self.date_time, self.club.timezone) if self.date_time else 'Date TBA'}
+Book: {f"[{escape_markdown(self.book_title or self.book_olid)}](https://openlibrary.org/books/{self.book_olid}/)" if self.book_olid else 'TBA'}
 Pages: {self.book_pages if self.book_pages else 'TBA'}
 
 To delete this meeting: `/delete_meeting {self.id}`
@@ -76,15 +124,70 @@ To update this meetings book: `/set_meeting_book {self.id} [OLID]`
 To update this meetings pages: `/set_meeting_pages {self.id} [pages]`
 '''
 
+    def __str__(self):
+        return self.render()
+
+
 class Suggestion(Base):
     __tablename__ = "suggestion"
 
     id = Column(Integer, primary_key=True)
-    club_id = Column(Integer, ForeignKey("club.id"))
+    club_id = Column(Integer, ForeignKey("club.id"), index=True)
     club = relationship("Club", back_populates="suggestions")
     last_voted_on = Column(DateTime)
+    book_olid = Column(String, index=True)
+    suggested_by = Column(String)
+
+
+class SuggestionHistory(Base):
+    """Suggestions removed because their book was picked for a meeting"""
+    __tablename__ = "suggestion_history"
+
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey("club.id", ondelete="CASCADE"))
+    meeting_id = Column(Integer, ForeignKey("meeting.id", ondelete="SET NULL"))
     book_olid = Column(String)
+    book_title = Column(String)
     suggested_by = Column(String)
+    picked_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_suggestion_history_club_id_picked_at', 'club_id', 'picked_at'),
+    )
+
+
+class Poll(Base):
+    __tablename__ = "poll"
+
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey("club.id"), index=True)
+    club = relationship("Club", back_populates="polls")
+    telegram_poll_id = Column(String, unique=True)
+    message_id = Column(String)
+    opened_at = Column(DateTime)
+    closed_at = Column(DateTime)
+    options = relationship("PollOption", back_populates="poll", order_by="PollOption.index", cascade="all, delete-orphan")
+
+    def winner(self) -> Optional['PollOption']:
+        """The option with the most votes, the first one listed on a tie"""
+        return max(self.options, key=lambda o: o.voter_count, default=None)
+
+
+class PollOption(Base):
+    __tablename__ = "poll_option"
+
+    id = Column(Integer, primary_key=True)
+    poll_id = Column(Integer, ForeignKey("poll.id", ondelete="CASCADE"), nullable=False)
+    poll = relationship("Poll", back_populates="options")
+    index = Column(Integer, nullable=False)
+    suggestion_id = Column(Integer, ForeignKey("suggestion.id", ondelete="SET NULL"), index=True)
+    book_olid = Column(String)
+    book_title = Column(String)
+    voter_count = Column(Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        UniqueConstraint('poll_id', 'index'),
+    )
 
 
 class Club(Base):
@@ -93,38 +196,88 @@ class Club(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     chat_id = Column(String, unique=True)
+    timezone = Column(String, nullable=False, default=DEFAULT_TIMEZONE, server_default=DEFAULT_TIMEZONE)
     meetings = relationship("Meeting")
     suggestions = relationship("Suggestion")
     admins = relationship("Admin")
-    poll_msg_id = Column(String)
+    polls = relationship("Poll", back_populates="club")
     scheduled_offset_tasks = relationship("ScheduledOffsetTask")
     scheduled_repeating_tasks = relationship("ScheduledRepeatingTask")
 
     def get_next_meeting(self) -> Optional[Meeting]:
-        # This is not very effecient but it shouldn't be a problem
-        for meeting in sorted(self.meetings, key=lambda m: m.date_time):
-            if meeting.date_time and meeting.date_time > datetime.now():
-                return meeting
-        return None
+        """Memoized for the lifetime of the session, see forget_next_meetings"""
+        session = object_session(self)
+        next_meetings = session.info.setdefault('next_meetings', {})
+        if self.id not in next_meetings:
+            next_meetings[self.id] = session.query(Meeting)\
+                .filter(Meeting.club_id == self.id, Meeting.date_time > utcnow())\
+                .order_by(Meeting.date_time)\
+                .first()
+        return next_meetings[self.id]
 
     def pick_n_suggestions(self, n) -> [Suggestion]:
-        """Randomly picks up to n Suggestions"""
-        if len(self.suggestions) <= n:
-            return self.suggestions
-        return random.sample(self.suggestions, n)
+        """Randomly picks up to n Suggestions, favoring ones that haven't been in a poll recently"""
+        # Weighted sampling without replacement done by postgres (Efraimidis-Spirakis): the n rows with the
+        # largest random() ^ (1 / weight) win. The weight grows by one per day since the last poll, never polled is a year.
+        days_since_voted_on = func.coalesce(
+            func.extract('epoch', literal(utcnow()) - Suggestion.last_voted_on) / 86400, 365)
+        weight = 1 + func.greatest(days_since_voted_on, 0)
+        return object_session(self).query(Suggestion)\
+            .filter(Suggestion.club_id == self.id)\
+            .order_by(func.power(func.random(), 1.0 / weight).desc())\
+            .limit(n)\
+            .all()
+
+    def archive_suggestions_of(self, book_olid: str, book_title: str, meeting_id: int) -> int:
+        """Moves this club's suggestions of a book into suggestion_history in one statement, returns how many"""
+        deleted = delete(Suggestion)\
+            .where(Suggestion.club_id == self.id, Suggestion.book_olid == book_olid)\
+            .returning(Suggestion.club_id, Suggestion.book_olid, Suggestion.suggested_by)\
+            .cte('deleted')
+        archived = insert(SuggestionHistory).from_select(
+            ['club_id', 'book_olid', 'suggested_by', 'book_title', 'meeting_id', 'picked_at'],
+            select(deleted.c.club_id, deleted.c.book_olid, deleted.c.suggested_by,
+                   literal(book_title), literal(meeting_id), literal(utcnow()))
+        )
+        return object_session(self).execute(archived).rowcount
+
+    def past_picks(self, n: int = 10) -> list:
+        """The n latest picked books, with when they were picked and how many times they had been suggested"""
+        return object_session(self).query(
+                SuggestionHistory.book_olid,
+                SuggestionHistory.book_title,
+                func.max(SuggestionHistory.picked_at).label('picked_at'),
+                func.count(SuggestionHistory.id).label('suggestions'))\
+            .filter(SuggestionHistory.club_id == self.id)\
+            .group_by(SuggestionHistory.meeting_id, SuggestionHistory.book_olid, SuggestionHistory.book_title)\
+            .order_by(func.max(SuggestionHistory.picked_at).desc())\
+            .limit(n)\
+            .all()
+
+    def count_suggestions(self) -> int:
+        return object_session(self).query(func.count(Suggestion.id)).filter(Suggestion.club_id == self.id).scalar()
 
     def get_chunked_suggestion_strs(self, update: Update, page: int, n:int=4) -> [list]:
-        suggestions_strs = []
+        suggestions = object_session(self).query(Suggestion)\
+            .filter(Suggestion.club_id == self.id)\
+            .order_by(Suggestion.id)\
+            .limit(n)\
+            .offset(page*n)\
+            .all()
+        books = book_cache.get_many(s.book_olid for s in suggestions)
+        names = member_names.get_many(update.effective_chat, (s.suggested_by for s in suggestions))
         next_meeting = self.get_next_meeting()
-        for s in self.suggestions[page*n:(page+1)*n]:
-            b = openlibrary.get(s.book_olid)
+        suggestions_strs = []
+        for s in suggestions:
+            b = books.get(s.book_olid)
             suggestions_strs.append(f'''
-- [{escape_markdown(b.title)}](https://openlibrary.org/books/{b.olid}) by {", ".join([a.name for a in b.authors])}
-    Suggested by: {escape_markdown(update.effective_chat.get_member(s.suggested_by).user.first_name)}
+- {f"[{escape_markdown(b.title)}](https://openlibrary.org/books/{b.olid}) by {', '.join(b.authors)}" if b else s.book_olid}
+    Suggested by: {escape_markdown(names[s.suggested_by])}
     {f"Manually select for next meeting: `/smb {next_meeting.id} {s.id}`" if next_meeting else ""}
     Remove this suggestion: `/ds {s.id}`''')
         return ''.join(suggestions_strs)
 
+
 class Admin(Base):
     __tablename__ = "admin"
 
@@ -133,10 +286,60 @@ class Admin(Base):
     club = relationship("Club", back_populates="admins")
     user_id = Column(String)
 
+    __table_args__ = (
+        UniqueConstraint('club_id', 'user_id'),
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def forget_next_meetings(session: Session, flush_context) -> None:
+    if any(isinstance(o, Meeting) for o in (*session.new, *session.dirty, *session.deleted)):
+        session.info.pop('next_meetings', None)
+
+
+session_creator = sessionmaker(bind=engine)
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """One unit of work: rolled back if anything raises, always closed"""
+    session = session_creator()
+    try:
+        yield session
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def wait_for_database(timeout: float = 30) -> None:
+    """Blocks until Postgres accepts connections, raising the last error after `timeout` seconds"""
+    deadline = monotonic() + timeout
+    delay = 0.1
+    while True:
+        try:
+            with engine.connect():
+                return
+        except OperationalError:
+            if monotonic() + delay > deadline:
+                raise
+            sleep(delay)
+            delay = min(delay * 2, 2)
+
+
+def try_advisory_lock(session: Session, name: str) -> bool:
+    """Takes a Postgres advisory lock until the session's transaction ends, False if another session holds it"""
+    return session.execute(select(func.pg_try_advisory_xact_lock(crc32(name.encode())))).scalar()
+
 
-def session_creator() -> Session:
-    session = sessionmaker(bind=engine)
-    return session()
+def pool_stats() -> dict:
+    return {
+        'size': engine.pool.size(),
+        'checked_in': engine.pool.checkedin(),
+        'checked_out': engine.pool.checkedout(),
+        'overflow': engine.pool.overflow(),
+    }
 
 
-global_session: Session = session_creator()
\ No newline at end of file
+book_cache = book_cache_from_env(Book, session_creator)
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from functools import wraps
+from os import getenv
+import logging
+from threading import local
+from time import perf_counter
+from typing import Iterator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return f'{self.statements} statements in {self.seconds * 1000:.1f}ms'
+
+
+logger = logging.getLogger(__name__)
+_local = local()
+# Handlers running more statements than this are logged as warnings, they likely have an N+1 query problem
+WARN_STATEMENTS = int(getenv('QUERY_WARN_STATEMENTS', 20))
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Counts the statements executed by this thread while the block runs, nested blocks count towards their parents"""
+    stats = QueryStats()
+    parent = getattr(_local, 'stats', None)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = parent
+        if parent:
+            parent.statements += stats.statements
+            parent.seconds += stats.seconds
+
+
+def log_queries(func):
+    """Logs the number of statements and the database time of every call"""
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        with track_queries() as stats:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                level = logging.WARNING if stats.statements > WARN_STATEMENTS else logging.DEBUG
+                logger.log(level, f'{func.__qualname__}: {stats}')
+    return wrapped
+
+
+def install(engine: Engine) -> None:
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context._query_started
+        stats = getattr(_local, 'stats', None)
+        if stats:
+            stats.statements += 1
+            stats.seconds += elapsed
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Dict, Optional
+import logging
+from telegram import Chat, error
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class MemberNames:
+    """Caches chat members' first names so rendering a list of users doesn't call getChatMember for each of them"""
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 24 * 60 * 60):
+        self.names = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='members')
+
+    def get_many(self, chat: Chat, user_ids: Iterable[str]) -> Dict[str, str]:
+        names = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            name = self.names.get((chat.id, user_id))
+            if name is not None:
+                names[user_id] = name
+            else:
+                missing.append(user_id)
+        for user_id, name in zip(missing, self.pool.map(lambda user_id: self._fetch(chat, user_id), missing)):
+            if name is None:
+                # Don't remember failures for long, they may be transient
+                name = 'a former member'
+                self.names.set((chat.id, user_id), name, ttl=60)
+            else:
+                self.names.set((chat.id, user_id), name)
+            names[user_id] = name
+        return names
+
+    @staticmethod
+    def _fetch(chat: Chat, user_id: str) -> Optional[str]:
+        try:
+            return chat.get_member(user_id).user.first_name
+        except error.TelegramError:
+            logger.warning(f'Could not look up member {user_id} of chat {chat.id}')
+            return None
+
+
+member_names = MemberNames()
@@ -0,0 +1,109 @@
+from contextlib import contextmanager
+from functools import wraps
+from os import getenv
+from threading import Timer, get_ident
+from time import perf_counter
+from typing import Callable, Iterator
+import logging
+import sys
+import traceback
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from telegram.utils.request import Request
+from db.query_stats import track_queries
+
+logger = logging.getLogger(__name__)
+
+handler_requests = Counter('bot_handler_requests_total', 'Handler and job calls', ['handler'])
+handler_errors = Counter('bot_handler_errors_total', 'Handler and job calls that raised', ['handler'])
+handler_latency = Histogram('bot_handler_latency_seconds', 'Handler and job wall time', ['handler'])
+handler_sql_seconds = Histogram('bot_handler_sql_seconds', 'Database time per handler or job call', ['handler'])
+handler_sql_statements = Counter('bot_handler_sql_statements_total', 'SQL statements run by handlers and jobs', ['handler'])
+openlibrary_requests = Counter('bot_openlibrary_requests_total', 'Calls to OpenLibrary', ['endpoint'])
+openlibrary_errors = Counter('bot_openlibrary_errors_total', 'Calls to OpenLibrary that failed', ['endpoint'])
+openlibrary_latency = Histogram('bot_openlibrary_latency_seconds', 'OpenLibrary call latency', ['endpoint'])
+telegram_requests = Counter('bot_telegram_requests_total', 'Bot API calls', ['method'])
+telegram_errors = Counter('bot_telegram_errors_total', 'Bot API calls that failed', ['method'])
+telegram_latency = Histogram('bot_telegram_latency_seconds', 'Bot API call latency', ['method'])
+
+# Handlers taking longer than this get their stack logged while they are still running, unset disables it
+SLOW_HANDLER_SECONDS = float(getenv('SLOW_HANDLER_SECONDS', 0))
+
+
+def _dump_stack(name: str, thread_id: int) -> None:
+    frame = sys._current_frames().get(thread_id)
+    if frame:
+        logger.warning(f'{name} is taking over {SLOW_HANDLER_SECONDS}s, currently at:\n{"".join(traceback.format_stack(frame))}')
+
+
+@contextmanager
+def observe(name: str) -> Iterator[None]:
+    """Records one call of handler or job `name`"""
+    handler_requests.labels(name).inc()
+    watchdog = None
+    if SLOW_HANDLER_SECONDS:
+        watchdog = Timer(SLOW_HANDLER_SECONDS, _dump_stack, (name, get_ident()))
+        watchdog.daemon = True
+        watchdog.start()
+    started = perf_counter()
+    with track_queries() as stats:
+        try:
+            yield
+        except BaseException:
+            handler_errors.labels(name).inc()
+            raise
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            handler_latency.labels(name).observe(perf_counter() - started)
+            handler_sql_seconds.labels(name).observe(stats.seconds)
+            handler_sql_statements.labels(name).inc(stats.statements)
+
+
+def instrument(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        with observe(func.__name__):
+            return func(*args, **kwargs)
+    return wrapped
+
+
+@contextmanager
+def openlibrary_call(endpoint: str) -> Iterator[None]:
+    openlibrary_requests.labels(endpoint).inc()
+    started = perf_counter()
+    try:
+        yield
+    except BaseException:
+        openlibrary_errors.labels(endpoint).inc()
+        raise
+    finally:
+        openlibrary_latency.labels(endpoint).observe(perf_counter() - started)
+
+
+class CountingRequest(Request):
+    """Request that records every Bot API call, whichever code path makes it"""
+
+    def post(self, url: str, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        telegram_requests.labels(method).inc()
+        started = perf_counter()
+        try:
+            return super().post(url, data, timeout)
+        except Exception:
+            telegram_errors.labels(method).inc()
+            raise
+        finally:
+            telegram_latency.labels(method).observe(perf_counter() - started)
+
+
+def gauge(name: str, documentation: str, read: Callable[[], float]) -> None:
+    Gauge(name, documentation).set_function(read)
+
+
+def serve(worker: int = 0, port_var: str = 'METRICS_PORT') -> None:
+    """Serves /metrics on the port in the `port_var` environment variable, webhook workers use the following ports"""
+    if not getenv(port_var):
+        return
+    port = int(getenv(port_var)) + worker
+    start_http_server(port, addr=getenv('METRICS_ADDR', '127.0.0.1'))
+    logger.info(f'Serving metrics on port {port}')
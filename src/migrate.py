@@ -0,0 +1,44 @@
+"""Brings the database schema up to date, only loading Alembic's migration environment if it is behind"""
+from dotenv import load_dotenv
+load_dotenv()
+from os import getenv, path
+from time import perf_counter
+import logging
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from db.models import engine, wait_for_database
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), '..')
+
+
+def alembic_config() -> Config:
+    config = Config(path.join(ROOT, 'alembic.ini'))
+    config.set_main_option('script_location', path.join(ROOT, 'src', 'db', 'alembic'))
+    return config
+
+
+def main() -> None:
+    started = perf_counter()
+    wait_for_database(float(getenv("DB_CONNECT_TIMEOUT", 30)))
+    config = alembic_config()
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current == heads:
+        logger.info(f'Database is at {", ".join(sorted(heads))}, checked in {perf_counter() - started:.2f}s')
+        return
+    logger.info(f'Upgrading database from {", ".join(sorted(current)) or "nothing"} to {", ".join(sorted(heads))}')
+    command.upgrade(config, 'heads')
+    logger.info(f'Database upgraded in {perf_counter() - started:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
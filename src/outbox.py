@@ -0,0 +1,171 @@
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from os import getenv
+from threading import Condition, Thread
+from time import monotonic
+from typing import Optional
+import logging
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Lanes, lower goes first
+INTERACTIVE = 0
+BULK = 1
+
+_Call = namedtuple('_Call', ['chat_id', 'priority', 'method', 'kwargs', 'future'])
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class Outbox:
+    """
+    Sends Bot API calls from a few worker threads, limited by a global and a per chat token bucket.
+    Interactive calls go ahead of bulk ones, calls to one chat are made in order and RetryAfter errors are waited out.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 20 / 60, chat_burst: float = 3, workers: int = 4):
+        self.bot: Optional[Bot] = None
+        self.workers = workers
+        self.sent = 0
+        self.retries = 0
+        self.failures = 0
+        self._lanes = {INTERACTIVE: deque(), BULK: deque()}
+        self._in_flight = set()
+        self._cond = Condition()
+        self.configure(global_rate, chat_rate, chat_burst)
+
+    def configure(self, global_rate: float, chat_rate: float, chat_burst: float) -> None:
+        with self._cond:
+            self.global_rate = global_rate
+            self.chat_rate = chat_rate
+            self.chat_burst = chat_burst
+            self._global = TokenBucket(global_rate, global_rate)
+            self._chats = {}
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        for i in range(self.workers):
+            Thread(target=self._work, name=f'outbox-{i}', daemon=True).start()
+
+    def call(self, method: str, chat_id, priority: int = INTERACTIVE, **kwargs) -> Future:
+        """Queues bot.<method>(chat_id=chat_id, **kwargs), the future resolves to its result"""
+        future = Future()
+        with self._cond:
+            self._lanes[priority].append(_Call(str(chat_id), priority, method, dict(kwargs, chat_id=chat_id), future))
+            self._cond.notify()
+        return future
+
+    def send_message(self, chat_id, text: str, priority: int = INTERACTIVE, **kwargs) -> Future:
+        return self.call('send_message', chat_id, priority, text=text, **kwargs)
+
+    def send_photo(self, chat_id, photo, priority: int = INTERACTIVE, **kwargs) -> Future:
+        return self.call('send_photo', chat_id, priority, photo=photo, **kwargs)
+
+    def send_poll(self, chat_id, question: str, options: list, priority: int = INTERACTIVE, **kwargs) -> Future:
+        return self.call('send_poll', chat_id, priority, question=question, options=options, **kwargs)
+
+    def pin(self, chat_id, message_id: int, priority: int = INTERACTIVE, **kwargs) -> Future:
+        return self.call('pin_chat_message', chat_id, priority, message_id=message_id, **kwargs)
+
+    def delete(self, chat_id, message_id: int, priority: int = INTERACTIVE, **kwargs) -> Future:
+        return self.call('delete_message', chat_id, priority, message_id=message_id, **kwargs)
+
+    def depth(self) -> dict:
+        with self._cond:
+            return {'interactive': len(self._lanes[INTERACTIVE]), 'bulk': len(self._lanes[BULK]), 'in_flight': len(self._in_flight)}
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything queued so far has been sent"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._in_flight and not any(self._lanes.values()), timeout)
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next_call(self):
+        """Pops the first call that may be made now, or returns how long to wait for one. Caller holds the lock"""
+        now = monotonic()
+        wait = None
+        global_wait = self._global.wait_time(now)
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            blocked = set(self._in_flight)
+            for call in lane:
+                if call.chat_id in blocked:
+                    continue
+                chat_wait = max(global_wait, self._chat_bucket(call.chat_id).wait_time(now))
+                if chat_wait == 0:
+                    lane.remove(call)
+                    self._global.take()
+                    self._chat_bucket(call.chat_id).take()
+                    self._in_flight.add(call.chat_id)
+                    return call, None
+                blocked.add(call.chat_id)
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                call, wait = self._next_call()
+                while call is None:
+                    self._cond.wait(wait)
+                    call, wait = self._next_call()
+            self._make(call)
+
+    def _make(self, call: _Call) -> None:
+        retry_after = None
+        try:
+            result = getattr(self.bot, call.method)(**call.kwargs)
+            self.sent += 1
+            call.future.set_result(result)
+        except RetryAfter as e:
+            self.retries += 1
+            retry_after = e.retry_after
+            logger.warning(f'Rate limited by Telegram in chat {call.chat_id}, retrying in {retry_after}s')
+        except TelegramError as e:
+            self.failures += 1
+            logger.warning(f'{call.method} in chat {call.chat_id} failed: {e}')
+            call.future.set_exception(e)
+        except Exception as e:
+            self.failures += 1
+            logger.exception(f'{call.method} in chat {call.chat_id} failed')
+            call.future.set_exception(e)
+        with self._cond:
+            self._in_flight.discard(call.chat_id)
+            if retry_after is not None:
+                self._chat_bucket(call.chat_id).blocked_until = monotonic() + retry_after
+                self._lanes[call.priority].appendleft(call)
+            self._cond.notify_all()
+
+
+outbox = Outbox(
+    global_rate=float(getenv('TELEGRAM_GLOBAL_RATE', 30)),
+    chat_rate=float(getenv('TELEGRAM_CHAT_RATE', 20 / 60)),
+    chat_burst=float(getenv('TELEGRAM_CHAT_BURST', 3)),
+    workers=int(getenv('TELEGRAM_SEND_WORKERS', 4))
+)
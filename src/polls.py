@@ -0,0 +1,63 @@
+from typing import Optional, Sequence
+from db.models import book_cache, Session, Club, Suggestion, Poll, PollOption
+from outbox import outbox, INTERACTIVE
+from utils import utcnow
+
+# Telegram's limit on the length of a poll option
+MAX_OPTION_LENGTH = 100
+
+
+def option_text(title: str) -> str:
+    return title if len(title) <= MAX_OPTION_LENGTH else f'{title[:MAX_OPTION_LENGTH - 1].rstrip()}…'
+
+
+def open_suggestion_poll(session: Session, club: Club, priority: int = INTERACTIVE) -> Optional[str]:
+    """Posts, pins and stores a poll between up to 10 suggestions, returns why it couldn't if it didn't"""
+    candidates = club.pick_n_suggestions(10)
+    if len(candidates) < 2:
+        return 'Too few suggestions to run a poll!'
+    session.query(Suggestion)\
+        .filter(Suggestion.id.in_([c.id for c in candidates]))\
+        .update({Suggestion.last_voted_on: utcnow()}, synchronize_session=False)
+    books = book_cache.get_many(c.book_olid for c in candidates)
+    options = {}
+    for candidate in candidates:
+        book = books.get(candidate.book_olid)
+        if book and book.olid not in options:
+            options[book.olid] = PollOption(index=len(options), suggestion_id=candidate.id, book_olid=book.olid, book_title=book.title)
+    if len(options) < 2:
+        return 'Too few suggestions to run a poll!'
+    sent = outbox.send_poll(
+        club.chat_id,
+        question=f'Vote for our next book!',
+        options=[option_text(o.book_title) for o in options.values()],
+        allows_multiple_answers=True,
+        priority=priority
+    ).result()
+    club.polls.append(Poll(
+        telegram_poll_id=sent.poll.id,
+        message_id=str(sent.message_id),
+        opened_at=utcnow(),
+        options=list(options.values())
+    ))
+    session.commit()
+    outbox.pin(club.chat_id, sent.message_id, priority=priority)
+    return None
+
+
+def open_polls(session: Session, club: Club) -> Sequence[Poll]:
+    return session.query(Poll)\
+        .filter(Poll.club_id == club.id, Poll.closed_at.is_(None))\
+        .order_by(Poll.opened_at.desc())\
+        .all()
+
+
+def record_votes(session: Session, telegram_poll_id: str, voter_counts: Sequence[int]) -> bool:
+    """Stores the vote counts from a poll update, returns False for polls the bot doesn't know"""
+    poll = session.query(Poll).filter(Poll.telegram_poll_id == telegram_poll_id).first()
+    if not poll:
+        return False
+    for option, voter_count in zip(poll.options, voter_counts):
+        option.voter_count = voter_count
+    session.commit()
+    return True
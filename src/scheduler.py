@@ -0,0 +1,305 @@
+from datetime import datetime, timedelta
+from collections import defaultdict
+from functools import lru_cache
+from threading import Lock
+from typing import Optional, List
+import logging
+from durations import Duration
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+from telegram import ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CallbackContext, JobQueue
+from utils import utcnow
+from db.query_stats import log_queries
+from outbox import outbox, BULK
+import metrics
+from db.models import session_scope, Session, Club, Meeting, ScheduledOffsetTask, ScheduledRepeatingTask, task_to_meeting_table
+from polls import open_suggestion_poll
+
+logger = logging.getLogger(__name__)
+
+# Tasks that came due while the bot was down are still run if they are at most this late
+GRACE_PERIOD = timedelta(hours=1)
+# How long a scheduler waits before trying again after a run failed, e.g. because the database was unreachable
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def plan_offset_task(session: Session, task: ScheduledOffsetTask, now: Optional[datetime] = None) -> None:
+    plan_offset_tasks(session, [task], now)
+
+
+def plan_offset_tasks(session: Session, tasks: List[ScheduledOffsetTask], now: Optional[datetime] = None) -> None:
+    """Points each task at the first upcoming meeting it has not run on yet and stores when it is due, in two queries"""
+    now = now or utcnow()
+    plannable = []
+    for task in tasks:
+        if task.offset_seconds is None:
+            try:
+                task.offset_seconds = int(Duration(task.when).to_seconds())
+            except Exception:
+                logger.warning(f'Offset task {task.id} has an invalid duration {task.when!r}')
+                task.next_meeting_id = task.next_run_at = None
+                continue
+        plannable.append(task)
+    if not plannable:
+        return
+    meetings = defaultdict(list)
+    for meeting_id, club_id, date_time in session.query(Meeting.id, Meeting.club_id, Meeting.date_time)\
+            .filter(Meeting.club_id.in_({t.club_id for t in plannable}), Meeting.date_time > now)\
+            .order_by(Meeting.date_time):
+        meetings[club_id].append((meeting_id, date_time))
+    already_run = set(session.query(task_to_meeting_table.c.scheduled_offset_task_id, task_to_meeting_table.c.meeting_id)
+                      .filter(task_to_meeting_table.c.scheduled_offset_task_id.in_([t.id for t in plannable])))
+    for task in plannable:
+        offset = timedelta(seconds=task.offset_seconds)
+        earliest = max(now, now - GRACE_PERIOD + offset)
+        task.next_meeting_id = task.next_run_at = None
+        for meeting_id, date_time in meetings[task.club_id]:
+            if date_time > earliest and (task.id, meeting_id) not in already_run:
+                task.next_meeting_id = meeting_id
+                task.next_run_at = date_time - offset
+                break
+
+
+@lru_cache(maxsize=256)
+def describe_offset(when: str) -> str:
+    return ', '.join([f'{d.value:g} {d.scale.representation.long_plural if d.value > 1 else d.scale.representation.long_singular}' for d in Duration(when).parsed_durations])
+
+
+SUGGEST_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Suggest a book", switch_inline_query_current_chat='')
+    ]
+])
+
+
+def nag(ctx: CallbackContext, task: ScheduledOffsetTask, meeting: Meeting) -> None:
+    club = task.club
+    sent = outbox.send_message(club.chat_id, f'''
+Reminder: {club.name} is meeting {f"in {describe_offset(task.when)}" if task.offset_seconds else "now"}!
+{meeting.render()}''', priority=BULK, parse_mode=ParseMode.MARKDOWN, reply_markup=SUGGEST_KEYBOARD)
+    sent.add_done_callback(lambda f: f.exception() or outbox.pin(club.chat_id, f.result().message_id, priority=BULK))
+
+
+actions = {
+    'nag': nag,
+}
+
+
+def plan_repeating_task(task: ScheduledRepeatingTask, now: Optional[datetime] = None) -> None:
+    """Moves next_run_at to the task's first run after now, skipping runs missed by more than the grace period"""
+    now = now or utcnow()
+    if task.interval_seconds is None:
+        try:
+            task.interval_seconds = int(Duration(task.when).to_seconds())
+        except Exception:
+            task.interval_seconds = 0
+    if task.interval_seconds <= 0:
+        logger.warning(f'Repeating task {task.id} has an invalid interval {task.when!r}')
+        task.next_run_at = None
+        return
+    interval = timedelta(seconds=task.interval_seconds)
+    if task.next_run_at is None:
+        task.next_run_at = now + interval
+    elif task.next_run_at <= now:
+        missed = (now - task.next_run_at) // interval + 1
+        task.next_run_at += missed * interval
+
+
+def progress_nag(ctx: CallbackContext, session: Session, task: ScheduledRepeatingTask) -> None:
+    club = task.club
+    meeting = club.get_next_meeting()
+    if not meeting:
+        return
+    outbox.send_message(club.chat_id, f'''
+Reading check-in for {club.name}! Next meeting:
+{meeting.render()}''', priority=BULK, parse_mode=ParseMode.MARKDOWN)
+
+
+def scheduled_poll(ctx: CallbackContext, session: Session, task: ScheduledRepeatingTask) -> None:
+    problem = open_suggestion_poll(session, task.club, priority=BULK)
+    if problem:
+        logger.info(f'Repeating task {task.id} did not open a poll: {problem}')
+
+
+repeating_actions = {
+    'nag': progress_nag,
+    'open_poll': scheduled_poll,
+}
+
+
+class DueTaskScheduler:
+    """
+    Keeps a single job queue job armed for the earliest `next_run_at` of `model`, so tasks cost nothing between runs.
+    Subclasses implement run_tasks and can plan unplanned tasks in prepare.
+    """
+    model = None
+
+    def __init__(self):
+        self.job_queue: Optional[JobQueue] = None
+        self._job = None
+        self._wake_at: Optional[datetime] = None
+        self._lock = Lock()
+
+    def start(self, job_queue: JobQueue, poll_interval: Optional[float] = None) -> None:
+        """`poll_interval` rechecks the earliest due time periodically, for when other processes plan tasks"""
+        self.job_queue = job_queue
+        with session_scope() as session:
+            self.prepare(session)
+            session.commit()
+            self.wake_at(self.next_due(session))
+        if poll_interval:
+            job_queue.run_repeating(self.poll, interval=poll_interval)
+
+    def prepare(self, session: Session) -> None:
+        pass
+
+    def poll(self, ctx: CallbackContext) -> None:
+        with session_scope() as session:
+            self.wake_at(self.next_due(session))
+
+    def next_due(self, session: Session) -> Optional[datetime]:
+        return session.query(func.min(self.model.next_run_at)).scalar()
+
+    def wake_at(self, when: Optional[datetime]) -> None:
+        if when is None or self.job_queue is None:
+            return
+        with self._lock:
+            if self._job and self._wake_at <= when:
+                return
+            if self._job:
+                self._job.schedule_removal()
+            self._wake_at = when
+            self._job = self.job_queue.run_once(self.run_due, max((when - utcnow()).total_seconds(), 0))
+
+    def run_due(self, ctx: CallbackContext) -> None:
+        with self._lock:
+            self._job = None
+            self._wake_at = None
+        failed = True
+        try:
+            with metrics.observe(type(self).__name__), session_scope() as session:
+                self.run_tasks(ctx, session, utcnow())
+            failed = False
+        finally:
+            self.rearm(failed)
+
+    def rearm(self, failed: bool) -> None:
+        """Arms the job for the next due task, retrying after RETRY_DELAY if the last run or the lookup failed"""
+        try:
+            with session_scope() as session:
+                when = self.next_due(session)
+        except Exception:
+            logger.exception(f'{type(self).__name__} could not look up the next due task')
+            when, failed = None, True
+        if failed:
+            retry_at = utcnow() + RETRY_DELAY
+            when = max(when, retry_at) if when else retry_at
+        self.wake_at(when)
+
+    def run_tasks(self, ctx: CallbackContext, session: Session, now: datetime) -> None:
+        raise NotImplementedError
+
+
+class OffsetTaskScheduler(DueTaskScheduler):
+    """Runs `ScheduledOffsetTask`s. Call plan_club whenever a club's meetings or offset tasks change."""
+    model = ScheduledOffsetTask
+
+    def prepare(self, session: Session) -> None:
+        plan_offset_tasks(session, session.query(ScheduledOffsetTask)
+                          .filter(ScheduledOffsetTask.next_run_at.is_(None))
+                          .with_for_update(skip_locked=True)
+                          .all())
+
+    def plan_club(self, session: Session, club: Club) -> None:
+        # Waits for a batch that is running these tasks to commit and plans from what it recorded, rather than
+        # overwriting its planning with a plan made before it finished
+        tasks = session.query(ScheduledOffsetTask)\
+            .filter(ScheduledOffsetTask.club_id == club.id)\
+            .with_for_update()\
+            .populate_existing()\
+            .all()
+        plan_offset_tasks(session, tasks)
+        session.commit()
+        self.wake_at(self.next_due(session))
+
+    def plan_task(self, session: Session, task: ScheduledOffsetTask) -> None:
+        session.flush()
+        session.query(ScheduledOffsetTask)\
+            .filter(ScheduledOffsetTask.id == task.id)\
+            .with_for_update()\
+            .populate_existing()\
+            .one()
+        plan_offset_task(session, task)
+        session.commit()
+        self.wake_at(task.next_run_at)
+
+    @log_queries
+    def run_tasks(self, ctx: CallbackContext, session: Session, now: datetime) -> None:
+        # Rows claimed by another process are skipped, and stay locked until this batch is committed
+        due = session.query(ScheduledOffsetTask)\
+            .options(joinedload(ScheduledOffsetTask.club), joinedload(ScheduledOffsetTask.next_meeting))\
+            .filter(ScheduledOffsetTask.next_run_at <= now)\
+            .order_by(ScheduledOffsetTask.next_run_at)\
+            .with_for_update(skip_locked=True, of=ScheduledOffsetTask)\
+            .all()
+        # Actions only queue their messages in the outbox, which sends them from its worker pool within
+        # Telegram's limits, so the whole batch is recorded with one insert and one commit
+        completed = []
+        for task in due:
+            meeting = task.next_meeting
+            if task.club and meeting and task.next_run_at > now - GRACE_PERIOD and task.action in actions:
+                try:
+                    actions[task.action](ctx, task, meeting)
+                except Exception:
+                    logger.exception(f'Running offset task {task.id} failed')
+            if meeting:
+                completed.append({'scheduled_offset_task_id': task.id, 'meeting_id': meeting.id})
+        if completed:
+            # A pair that is already recorded must not roll back the batch, its reminders are already queued
+            session.execute(insert(task_to_meeting_table).on_conflict_do_nothing(), completed)
+        plan_offset_tasks(session, due, now)
+        session.commit()
+
+
+class RepeatingTaskScheduler(DueTaskScheduler):
+    """Runs `ScheduledRepeatingTask`s every `interval_seconds`. Call plan_task after creating one."""
+    model = ScheduledRepeatingTask
+
+    def prepare(self, session: Session) -> None:
+        now = utcnow()
+        for task in session.query(ScheduledRepeatingTask).filter(ScheduledRepeatingTask.next_run_at.is_(None)):
+            plan_repeating_task(task, now)
+
+    def plan_task(self, session: Session, task: ScheduledRepeatingTask) -> None:
+        # A first run in the past is moved to its next occurrence instead of running late or being skipped
+        plan_repeating_task(task)
+        session.commit()
+        self.wake_at(task.next_run_at)
+
+    @log_queries
+    def run_tasks(self, ctx: CallbackContext, session: Session, now: datetime) -> None:
+        # Each task is claimed by moving its next_run_at forward before it runs, so no two processes run the
+        # same occurrence and the row isn't kept locked while a slow action like open_poll waits on Telegram
+        while True:
+            task = session.query(ScheduledRepeatingTask)\
+                .filter(ScheduledRepeatingTask.next_run_at <= now)\
+                .order_by(ScheduledRepeatingTask.next_run_at)\
+                .with_for_update(skip_locked=True)\
+                .first()
+            if task is None:
+                return
+            run = task.next_run_at > now - GRACE_PERIOD and task.action in repeating_actions
+            plan_repeating_task(task, now)
+            session.commit()
+            if run and task.club:
+                try:
+                    repeating_actions[task.action](ctx, session, task)
+                except Exception:
+                    logger.exception(f'Running repeating task {task.id} failed')
+                    session.rollback()
+
+
+offset_tasks = OffsetTaskScheduler()
+repeating_tasks = RepeatingTaskScheduler()
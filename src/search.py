@@ -0,0 +1,91 @@
+from collections import namedtuple
+from concurrent.futures import Future
+from os import getenv
+from threading import Lock
+from typing import List, Optional, Tuple
+import requests
+from cache import LRUCache
+import metrics
+
+SEARCH_URL = 'https://openlibrary.org/search.json'
+
+SearchResult = namedtuple('SearchResult', ['key', 'title', 'authors', 'cover_edition_key'])
+SearchPage = Tuple[List[SearchResult], Optional[int]]
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class BookSearch:
+    """
+    OpenLibrary title search fetching one page at a time.
+    Pages are cached by normalized query and offset, and concurrent identical searches share a single request.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 60 * 60, page_size: int = 20, timeout: float = 10):
+        self.page_size = page_size
+        self.timeout = timeout
+        self.pages = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.fetches = 0
+        self.http = requests.Session()
+        self._in_flight = {}
+        self._lock = Lock()
+
+    def cached(self, query: str, offset: int = 0) -> Optional[SearchPage]:
+        return self.pages.get((normalize_query(query), offset))
+
+    def search(self, query: str, offset: int = 0) -> SearchPage:
+        """Returns a page of results and the offset of the next page, or None if this was the last one"""
+        key = (normalize_query(query), offset)
+        page = self.pages.get(key)
+        if page is not None:
+            return page
+        with self._lock:
+            page = self.pages.get(key)
+            if page is not None:
+                return page
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            page = self._fetch(*key)
+            self.pages.set(key, page)
+            future.set_result(page)
+            return page
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _fetch(self, query: str, offset: int) -> SearchPage:
+        self.fetches += 1
+        with metrics.openlibrary_call('search'):
+            response = self.http.get(SEARCH_URL, params={
+                'title': query,
+                'fields': 'key,title,author_name,cover_edition_key',
+                'limit': self.page_size,
+                'offset': offset,
+            }, timeout=self.timeout)
+            response.raise_for_status()
+        data = response.json()
+        results = [
+            SearchResult(
+                key=doc['key'],
+                title=doc.get('title', ''),
+                authors=doc.get('author_name', []),
+                cover_edition_key=doc['cover_edition_key']
+            ) for doc in data.get('docs', []) if doc.get('cover_edition_key')]
+        next_offset = offset + self.page_size
+        return results, next_offset if next_offset < data.get('numFound', 0) else None
+
+
+book_search = BookSearch(
+    maxsize=int(getenv('SEARCH_CACHE_SIZE', 2048)),
+    ttl=float(getenv('SEARCH_CACHE_TTL', 60 * 60))
+)
@@ -1,9 +1,79 @@
 from datetime import datetime
-from pytz import timezone
+from functools import lru_cache
+from dateutil.parser import parse
+from dateutil.tz import gettz
+from pytz import timezone, utc, UnknownTimeZoneError
 
-est = timezone('America/New_York')
+DEFAULT_TIMEZONE = 'America/New_York'
 
+# Abbreviations dateutil should understand when they are part of a date
+tzinfos = {
+    "EST": gettz("America/New_York"),
+    "EDT": gettz("America/New_York"),
+    "CST": gettz("America/Chicago"),
+    "CDT": gettz("America/Chicago"),
+    "MST": gettz("America/Denver"),
+    "MDT": gettz("America/Denver"),
+    "PST": gettz("America/Los_Angeles"),
+    "PDT": gettz("America/Los_Angeles"),
+    "UTC": gettz("UTC"),
+    "GMT": gettz("UTC"),
+    "BST": gettz("Europe/London"),
+    "CET": gettz("Europe/Paris"),
+    "CEST": gettz("Europe/Paris"),
+    "AEST": gettz("Australia/Sydney"),
+    "AEDT": gettz("Australia/Sydney"),
+}
 
-def format_date(date: datetime) -> str:
-    date = date.astimezone(est)
+# Tried before falling back to dateutil's much slower guessing
+date_formats = (
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d %I:%M %p',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %I:%M %p',
+)
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name: str):
+    return timezone(name)
+
+
+def is_timezone(name: str) -> bool:
+    try:
+        get_timezone(name)
+        return True
+    except UnknownTimeZoneError:
+        return False
+
+
+def utcnow() -> datetime:
+    """Dates are stored as naive UTC"""
+    return datetime.utcnow()
+
+
+def to_utc(date: datetime) -> datetime:
+    return date.astimezone(utc).replace(tzinfo=None)
+
+
+def parse_date(text: str, tz_name: str = DEFAULT_TIMEZONE) -> datetime:
+    """Parses a user supplied date, dates without a timezone are in tz_name. Raises dateutil's ParserError"""
+    tz = get_timezone(tz_name)
+    text = text.strip().upper()
+    for date_format in date_formats:
+        try:
+            return tz.localize(datetime.strptime(text, date_format))
+        except ValueError:
+            pass
+    date = parse(text, tzinfos=tzinfos)
+    return tz.localize(date) if date.tzinfo is None else date
+
+
+@lru_cache(maxsize=4096)
+def format_date(date: datetime, tz_name: str = DEFAULT_TIMEZONE) -> str:
+    """Naive dates are UTC"""
+    if date.tzinfo is None:
+        date = utc.localize(date)
+    date = date.astimezone(get_timezone(tz_name))
     return date.strftime("%a, %b %d %Y at %I:%M %p %Z")
@@ -0,0 +1,138 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process, Queue
+from os import getenv
+from threading import Thread, Event
+from typing import Callable
+from zlib import crc32
+import hmac
+import json
+import logging
+import signal
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def shard_key(data: dict) -> int:
+    """Stable key for a raw update, updates from one chat (or user, outside of chats) share a key"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return int(chat['id'])
+        user = value.get('from') or value.get('user')
+        if user:
+            return int(user['id'])
+        if 'id' in value:
+            return crc32(str(value['id']).encode())
+    return int(data.get('update_id', 0))
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, path: str, secret: str, route: Callable[[dict], None]):
+        super().__init__(address, WebhookHandler)
+        self.webhook_path = path
+        self.secret = secret
+        self.route = route
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self.send_error(404)
+            return
+        if self.server.secret and not hmac.compare_digest(
+                self.headers.get(SECRET_HEADER, '').encode(), self.server.secret.encode()):
+            self.send_error(403)
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            data = None
+        # Updates are objects, anything else would fail in shard_key without an answer
+        if not isinstance(data, dict):
+            self.send_error(400)
+            return
+        self.server.route(data)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def _worker(index: int, updates: Queue, build: Callable, start: Callable, stop: Callable) -> None:
+    # The parent process handles signals and shuts workers down through their queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    updater = build()
+    start(updater, index)
+    Thread(target=updater.dispatcher.start, name='dispatcher', daemon=True).start()
+    updater.job_queue.start()
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        updater.dispatcher.update_queue.put(Update.de_json(data, updater.bot))
+    stop(updater)
+
+
+def serve(build: Callable[[], Updater], start: Callable[[Updater, int], None], stop: Callable[[Updater], None]) -> None:
+    """
+    Receives updates over HTTP and hands them to WEBHOOK_WORKERS worker processes, picked by chat so one chat's
+    updates are always handled in order by the same process. `start` gets the worker's index.
+    """
+    token = getenv("BOT_TOKEN")
+    secret = getenv("WEBHOOK_SECRET", "")
+    path = getenv("WEBHOOK_PATH", "/telegram")
+    workers = int(getenv("WEBHOOK_WORKERS", 1))
+
+    queues = [Queue() for _ in range(workers)]
+    processes = [Process(target=_worker, args=(i, q, build, start, stop), name=f'worker-{i}') for i, q in enumerate(queues)]
+    for process in processes:
+        process.start()
+
+    if getenv("WEBHOOK_URL"):
+        Bot(token).set_webhook(
+            url=getenv("WEBHOOK_URL"),
+            max_connections=int(getenv("WEBHOOK_MAX_CONNECTIONS", 40)),
+            api_kwargs={'secret_token': secret} if secret else None
+        )
+
+    server = WebhookServer(
+        (getenv("WEBHOOK_LISTEN", "0.0.0.0"), int(getenv("WEBHOOK_PORT", 8443))),
+        path,
+        secret,
+        lambda data: queues[shard_key(data) % workers].put(data)
+    )
+    if not secret:
+        logger.warning('WEBHOOK_SECRET is not set, anyone who knows the URL can post updates')
+    stopping = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+    Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    logger.info(f'Listening for updates on {server.server_address} {path} with {workers} worker(s)')
+    stopping.wait()
+
+    server.shutdown()
+    for q in queues:
+        q.put(None)
+    for process in processes:
+        process.join()
@@ -0,0 +1,45 @@
+from threading import Event
+from time import sleep
+import pytest
+
+pytest.importorskip('telegram')
+
+from concurrency import ChatSerialExecutor
+
+
+def test_calls_with_one_key_run_in_order():
+    executor = ChatSerialExecutor(workers=4)
+    ran = []
+
+    def handle(i):
+        sleep(0.001 * (i % 3))
+        ran.append(i)
+
+    for i in range(20):
+        executor.submit('chat', handle, i)
+    executor.shutdown()
+    assert ran == list(range(20))
+    assert executor.pending() == 0
+
+
+def test_other_keys_are_not_held_up():
+    executor = ChatSerialExecutor(workers=2)
+    released = Event()
+    results = []
+    executor.submit('slow chat', lambda: results.append(released.wait(5)))
+    executor.submit('other chat', released.set)
+    executor.shutdown()
+    assert results == [True]
+
+
+def test_a_failing_call_does_not_stop_its_key():
+    executor = ChatSerialExecutor(workers=1)
+    ran = []
+
+    def fail():
+        raise ValueError('boom')
+
+    executor.submit('chat', fail)
+    executor.submit('chat', ran.append, 'after')
+    executor.shutdown()
+    assert ran == ['after']
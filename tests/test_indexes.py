@@ -0,0 +1,79 @@
+"""
+Checks with EXPLAIN that the bot's hot queries can be answered from the indexes they are meant to use.
+
+Needs a database migrated to head, configured like the bot's, and is skipped without one. It only reads. Sequential
+scans are disabled for the session so the planner shows which index it would use even on tiny tables.
+"""
+import os
+import pytest
+from dotenv import load_dotenv
+load_dotenv()
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from db.models import engine, session_creator, Admin, Meeting, Poll, ScheduledOffsetTask, ScheduledRepeatingTask, Suggestion, SuggestionHistory, task_to_meeting_table
+from utils import utcnow
+
+SCRIPT_LOCATION = os.path.join(os.path.dirname(__file__), '..', 'src', 'db', 'alembic')
+
+# (description, query of a session, index the plan should use)
+HOT_QUERIES = [
+    ('suggestions of a club', lambda s: s.query(func.count(Suggestion.id)).filter(Suggestion.club_id == 1),
+     'ix_suggestion_club_id'),
+    ('suggestions of a book', lambda s: s.query(Suggestion).filter_by(book_olid='OL1M'),
+     'ix_suggestion_book_olid'),
+    ('admin check', lambda s: s.query(Admin).filter(Admin.club_id == 1, Admin.user_id == '1'),
+     'admin_club_id_user_id_key'),
+    ('next meeting', lambda s: s.query(Meeting).filter(Meeting.club_id == 1, Meeting.date_time > utcnow()).order_by(Meeting.date_time).limit(1),
+     'ix_meeting_club_id_date_time'),
+    ('offset tasks of a club', lambda s: s.query(ScheduledOffsetTask).filter(ScheduledOffsetTask.club_id == 1),
+     'ix_scheduled_offset_task_club_id'),
+    ('due offset tasks', lambda s: s.query(ScheduledOffsetTask).filter(ScheduledOffsetTask.next_run_at <= utcnow()),
+     'ix_scheduled_offset_task_next_run_at'),
+    ('due repeating tasks', lambda s: s.query(ScheduledRepeatingTask).filter(ScheduledRepeatingTask.next_run_at <= utcnow()),
+     'ix_scheduled_repeating_task_next_run_at'),
+    ('meetings an offset task ran on', lambda s: s.query(task_to_meeting_table.c.meeting_id)
+     .filter(task_to_meeting_table.c.scheduled_offset_task_id == 1), 'association_pkey'),
+    ('offset tasks that ran on a meeting', lambda s: s.query(task_to_meeting_table.c.scheduled_offset_task_id)
+     .filter(task_to_meeting_table.c.meeting_id == 1), 'ix_association_meeting_id'),
+    ('poll update', lambda s: s.query(Poll).filter(Poll.telegram_poll_id == '1'), 'poll_telegram_poll_id_key'),
+    ('open polls of a club', lambda s: s.query(Poll).filter(Poll.club_id == 1, Poll.closed_at.is_(None)), 'ix_poll_club_id'),
+    ('past picks', lambda s: s.query(SuggestionHistory).filter(SuggestionHistory.club_id == 1)
+     .order_by(SuggestionHistory.picked_at.desc()).limit(10), 'ix_suggestion_history_club_id_picked_at'),
+]
+
+
+def index_names(plan: dict) -> set:
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', ()):
+        names |= index_names(child)
+    return names
+
+
+@pytest.fixture(scope='module')
+def session():
+    config = Config()
+    config.set_main_option('script_location', SCRIPT_LOCATION)
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    try:
+        with engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+    except OperationalError:
+        pytest.skip('no database to explain the queries on')
+    if current != heads:
+        pytest.skip('the database is not migrated to head')
+    session = session_creator()
+    session.connection().exec_driver_sql('SET LOCAL enable_seqscan = off')
+    yield session
+    session.rollback()
+    session.close()
+
+
+@pytest.mark.parametrize('description, build, index', HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_query_uses_its_index(session, description, build, index):
+    compiled = build(session).statement.compile(engine)
+    plan = session.connection().exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params).scalar()[0]['Plan']
+    assert index in index_names(plan), f'{description} uses {", ".join(sorted(index_names(plan))) or plan["Node Type"]}'
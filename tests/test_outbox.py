@@ -0,0 +1,106 @@
+from time import monotonic
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram.error import RetryAfter
+from outbox import Outbox, TokenBucket, INTERACTIVE, BULK
+
+
+class FakeBot:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, chat_id, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def next_call(outbox: Outbox):
+    with outbox._cond:
+        return outbox._next_call()
+
+
+def test_token_bucket_starts_full():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.updated = 10.0
+    assert bucket.wait_time(10.0) == 0
+
+
+def test_token_bucket_waits_for_the_next_token():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.tokens, bucket.updated = 0.0, 10.0
+    assert bucket.wait_time(10.0) == pytest.approx(0.5)
+    assert bucket.wait_time(10.25) == pytest.approx(0.25)
+    assert bucket.wait_time(10.5) == 0
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.tokens, bucket.updated = 0.0, 0.0
+    bucket.wait_time(100.0)
+    assert bucket.tokens == 3
+    bucket.take()
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_waits_out_a_block():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.updated, bucket.blocked_until = 0.0, 5.0
+    assert bucket.wait_time(2.0) == pytest.approx(3.0)
+    assert bucket.wait_time(5.0) == 0
+
+
+def test_interactive_goes_ahead_of_bulk():
+    outbox = Outbox()
+    outbox.send_message(1, 'bulk', priority=BULK)
+    outbox.send_message(2, 'interactive', priority=INTERACTIVE)
+    call, _ = next_call(outbox)
+    assert call.kwargs['text'] == 'interactive'
+    call, _ = next_call(outbox)
+    assert call.kwargs['text'] == 'bulk'
+
+
+def test_one_chat_waits_for_its_call_in_flight():
+    outbox = Outbox()
+    outbox.bot = FakeBot()
+    outbox.send_message(1, 'first')
+    outbox.send_message(1, 'second')
+    outbox.send_message(2, 'other chat')
+    first, _ = next_call(outbox)
+    assert first.kwargs['text'] == 'first'
+    call, _ = next_call(outbox)
+    assert call.kwargs['text'] == 'other chat'
+    assert next_call(outbox) == (None, None)
+    outbox._make(first)
+    call, _ = next_call(outbox)
+    assert call.kwargs['text'] == 'second'
+
+
+def test_calls_to_one_chat_are_sent_in_order():
+    outbox = Outbox(chat_burst=20, workers=4)
+    bot = FakeBot()
+    outbox.start(bot)
+    futures = [outbox.send_message(1, str(i)) for i in range(20)]
+    assert outbox.drain(timeout=5)
+    assert [f.result() for f in futures] == [str(i) for i in range(20)]
+    assert bot.sent == [(1, str(i)) for i in range(20)]
+
+
+def test_retry_after_requeues_the_call_and_blocks_the_chat():
+    outbox = Outbox()
+    outbox.bot = FakeBot(RetryAfter(5))
+    future = outbox.send_message(1, 'first')
+    outbox.send_message(1, 'second')
+    call, _ = next_call(outbox)
+    outbox._make(call)
+    assert not future.done()
+    assert outbox.retries == 1
+    assert outbox._lanes[INTERACTIVE][0] is call
+    assert outbox._chat_bucket('1').blocked_until > monotonic() + 4
+    call, wait = next_call(outbox)
+    assert call is None
+    assert 4 < wait <= 5
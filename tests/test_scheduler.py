@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from db.models import ScheduledRepeatingTask
+from scheduler import plan_repeating_task
+
+NOW = datetime(2026, 10, 17, 12, 0)
+
+
+def task(when: str = '1 week', next_run_at=None) -> ScheduledRepeatingTask:
+    return ScheduledRepeatingTask(action='nag', when=when, next_run_at=next_run_at)
+
+
+def test_first_run_defaults_to_one_interval_from_now():
+    t = task('1 day')
+    plan_repeating_task(t, NOW)
+    assert t.interval_seconds == 24 * 60 * 60
+    assert t.next_run_at == NOW + timedelta(days=1)
+
+
+def test_future_first_run_is_kept():
+    t = task(next_run_at=NOW + timedelta(hours=3))
+    plan_repeating_task(t, NOW)
+    assert t.next_run_at == NOW + timedelta(hours=3)
+
+
+def test_past_first_run_moves_to_its_next_occurrence():
+    t = task(next_run_at=NOW - timedelta(days=10, hours=6))
+    plan_repeating_task(t, NOW)
+    assert t.next_run_at == NOW + timedelta(days=3, hours=18)
+
+
+def test_run_due_now_moves_a_whole_interval():
+    t = task('1 day', next_run_at=NOW)
+    plan_repeating_task(t, NOW)
+    assert t.next_run_at == NOW + timedelta(days=1)
+
+
+def test_invalid_interval_never_runs():
+    t = task('sometimes', next_run_at=NOW)
+    plan_repeating_task(t, NOW)
+    assert t.next_run_at is None
@@ -0,0 +1,43 @@
+from datetime import datetime
+import pytest
+from dateutil.parser import ParserError
+from utils import parse_date, format_date, to_utc, is_timezone
+
+
+def test_dates_without_a_zone_are_in_the_club_timezone():
+    assert to_utc(parse_date('2026-07-01 18:00', 'Europe/Paris')) == datetime(2026, 7, 1, 16, 0)
+    assert to_utc(parse_date('2026-01-15 18:00')) == datetime(2026, 1, 15, 23, 0)
+
+
+@pytest.mark.parametrize('text', ['2026-07-01 18:00', '2026-07-01T18:00', '2026-07-01 6:00 pm', '07/01/2026 18:00', '07/01/2026 06:00 PM', 'July 1 2026 6pm'])
+def test_date_formats(text):
+    assert to_utc(parse_date(text, 'UTC')) == datetime(2026, 7, 1, 18, 0)
+
+
+def test_zone_abbreviations_override_the_club_timezone():
+    assert to_utc(parse_date('2026-01-15 6pm PST', 'Europe/Paris')) == datetime(2026, 1, 16, 2, 0)
+    assert to_utc(parse_date('2026-07-01 6pm CEST', 'America/New_York')) == datetime(2026, 7, 1, 16, 0)
+
+
+def test_gmt_is_utc_all_year():
+    assert to_utc(parse_date('2026-07-01 6pm GMT')) == datetime(2026, 7, 1, 18, 0)
+    assert to_utc(parse_date('2026-07-01 6pm BST')) == datetime(2026, 7, 1, 17, 0)
+
+
+def test_unparseable_dates_raise():
+    with pytest.raises(ParserError):
+        parse_date('next thursday-ish')
+
+
+def test_naive_dates_are_formatted_from_utc():
+    assert format_date(datetime(2026, 1, 15, 23, 0)) == 'Thu, Jan 15 2026 at 06:00 PM EST'
+    assert format_date(datetime(2026, 7, 1, 16, 0), 'Europe/Paris') == 'Wed, Jul 01 2026 at 06:00 PM CEST'
+
+
+def test_parsed_dates_format_back_in_the_club_timezone():
+    assert format_date(to_utc(parse_date('2026-03-29 09:30', 'Australia/Sydney')), 'Australia/Sydney') == 'Sun, Mar 29 2026 at 09:30 AM AEDT'
+
+
+def test_is_timezone():
+    assert is_timezone('Europe/Paris')
+    assert not is_timezone('Mars/Olympus_Mons')
@@ -0,0 +1,69 @@
+from threading import Thread
+from zlib import crc32
+import json
+import urllib.error
+import urllib.request
+import pytest
+from webhook import WebhookServer, shard_key
+
+
+def test_messages_are_sharded_by_chat():
+    assert shard_key({'update_id': 1, 'message': {'message_id': 5, 'chat': {'id': -100123}, 'from': {'id': 42}}}) == -100123
+
+
+def test_callback_queries_are_sharded_by_the_chat_of_their_message():
+    update = {'update_id': 1, 'callback_query': {'id': '77', 'from': {'id': 42}, 'message': {'chat': {'id': -100123}}}}
+    assert shard_key(update) == -100123
+
+
+def test_inline_queries_are_sharded_by_user():
+    assert shard_key({'update_id': 1, 'inline_query': {'id': '88', 'from': {'id': 42}, 'query': 'dune'}}) == 42
+
+
+def test_polls_are_sharded_by_poll_id():
+    assert shard_key({'update_id': 1, 'poll': {'id': '5012', 'question': 'Next book?'}}) == crc32(b'5012')
+
+
+def test_poll_answers_are_sharded_by_user():
+    assert shard_key({'update_id': 1, 'poll_answer': {'poll_id': '5012', 'user': {'id': 42}, 'option_ids': [0]}}) == 42
+
+
+def test_unknown_updates_fall_back_to_the_update_id():
+    assert shard_key({'update_id': 9}) == 9
+
+
+@pytest.fixture
+def server():
+    routed = []
+    server = WebhookServer(('127.0.0.1', 0), '/telegram', 'secret', routed.append)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    server.routed = routed
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body: bytes, secret: str = 'secret') -> int:
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{server.server_port}/telegram', data=body, headers={'X-Telegram-Bot-Api-Secret-Token': secret})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_updates_are_routed(server):
+    assert post(server, json.dumps({'update_id': 9}).encode()) == 200
+    assert server.routed == [{'update_id': 9}]
+
+
+@pytest.mark.parametrize('body', [b'not json', b'[1, 2]', b'42', b'null'])
+def test_bodies_that_are_not_objects_are_rejected(server, body):
+    assert post(server, body) == 400
+    assert server.routed == []
+
+
+def test_wrong_secret_is_rejected(server):
+    assert post(server, json.dumps({'update_id': 9}).encode(), secret='guess') == 403
+    assert server.routed == []